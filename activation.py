@@ -0,0 +1,56 @@
+import hashlib
+import threading
+
+from aax_to_ogg.args import config
+from aax_to_ogg.cache import Store
+
+class ActivationHelper:
+    # the key that ffmpeg (and everyone else) uses for AAX files
+    fixed_key = bytes.fromhex('77214d4b196a87cd520045fd20a51d67')
+
+    store = None
+    store_lock = threading.Lock()
+
+    @classmethod
+    def get_store(cls):
+        # maps the file checksum (hex) to the activation bytes that match it
+        with cls.store_lock:
+            if cls.store is None:
+                cls.store = Store('activation_bytes')
+            return cls.store
+
+    @classmethod
+    def checksum_for(cls, activation_bytes):
+        # this is the key derivation that ffmpeg performs in mov_read_adrm()...
+        # the result is compared with the checksum held in the 'adrm' box
+        try:
+            ab = bytes.fromhex(activation_bytes)
+        except ValueError:
+            return None
+        if len(ab) != 4:
+            return None
+
+        key = hashlib.sha1(cls.fixed_key + ab).digest()
+        iv = hashlib.sha1(cls.fixed_key + key + ab).digest()
+        return hashlib.sha1(key[:16] + iv[:16]).digest()
+
+    @classmethod
+    def resolve(cls, checksum):
+        # returns the activation bytes that match the file checksum, or None
+        store = cls.get_store()
+        checksum_hex = checksum.hex()
+
+        known = store.get(checksum_hex)
+        candidates = [ known, *config.activation_bytes, *store.values() ]
+
+        for ab in candidates:
+            if ab is None:
+                continue
+            if cls.checksum_for(ab) != checksum:
+                continue
+
+            if ab != known:
+                store.set(checksum_hex, ab)
+            return ab
+
+        return None
@@ -3,6 +3,8 @@ import argparse
 import os.path
 import multiprocessing
 
+from aax_to_ogg.profiles import PROFILES
+
 class Args:
     def __init__(self):
         if os.path.basename(sys.argv[0]) == '__main__.py':
@@ -10,12 +12,12 @@ class Args:
         else:
             prog = None
 
-        self.p = argparse.ArgumentParser(prog = prog, description = 'Process ADH or AAX files in to Ogg/Vorbis')
+        self.p = argparse.ArgumentParser(prog = prog, description = 'Process ADH or AAX files in to Ogg/Vorbis (or other formats)')
 
-        # TODO: default = None - auto detect new users, and store the activation bytes _somewhere_
+        # activation bytes that match a file are remembered in the cache
         self.p.add_argument('-a', '--activation-bytes',
             type=str, action='append',
-            help='the activation bytes used by ffmpeg to decrypt the AAX files',
+            help='the activation bytes used by ffmpeg to decrypt the AAX files (remembered once they have been used)',
             default=[]
         )
 
@@ -25,24 +27,92 @@ class Args:
             default=96
         )
 
+        self.p.add_argument('-f', '--format',
+            type=str, action='store', choices=sorted(PROFILES),
+            help='the output format - "m4a", "m4b" and "mp3" copy the audio without re-encoding it, in to whichever of them suits the content',
+            default='vorbis'
+        )
+
         self.p.add_argument('-p', '--parallel',
             type=int, action='store',
             help='the number of ffmpeg processes to run in parallel',
             default=multiprocessing.cpu_count()
         )
 
+        self.p.add_argument('--cpu-budget',
+            type=int, action='store',
+            help='the number of CPU threads that the ffmpeg processes share between them',
+            default=multiprocessing.cpu_count()
+        )
+
+        self.p.add_argument('--nice',
+            type=int, action='store',
+            help='the niceness to run the ffmpeg processes with',
+            default=0
+        )
+
+        self.p.add_argument('--ionice',
+            type=str, action='store', choices=[ 'realtime', 'best-effort', 'idle' ],
+            help='the I/O scheduling class to run the ffmpeg processes in'
+        )
+
+        self.p.add_argument('--max-load',
+            type=float, action='store',
+            help='run fewer ffmpeg processes at once while the 1 minute load average is above this'
+        )
+
+        self.p.add_argument('--max-pressure',
+            type=float, action='store',
+            help='run fewer ffmpeg processes at once while the memory or CPU pressure (PSI, %% of time stalled) is above this'
+        )
+
+        self.p.add_argument('-m', '--metadata-parallel',
+            type=int, action='store',
+            help='the number of metadata lookups (and downloads) to run in parallel',
+            default=8
+        )
+
+        self.p.add_argument('--download-connections',
+            type=int, action='store',
+            help='the number of connections to use for each download',
+            default=4
+        )
+
+        self.p.add_argument('--stream',
+            action='store_true',
+            help='convert MP3 content while it is still downloading'
+        )
+
         self.p.add_argument('-d', '--domain',
             type=str, action='store',
             help='the Audible domain to use when locating metadata (only use for direct AAX ingestion)',
             default='www.audible.co.uk'
         )
 
+        self.p.add_argument('--http-cache-ttl',
+            type=float, action='store',
+            help='how long metadata fetched from Audible is trusted before it is revalidated, in days',
+            default=30
+        )
+
         self.p.add_argument('-l', '--library',
             type=os.path.abspath, action='store',
             help='the directory to use as the library',
             default='./audio'
         )
 
+        self.p.add_argument('-c', '--cache-dir',
+            type=os.path.abspath, action='store',
+            help='the directory to keep caches in (e.g: activation bytes)',
+            default=os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'aax_to_ogg')
+        )
+
+        self.p.add_argument('--probe-cache-size',
+            type=int, action='store',
+            help='the size of the probe cache, in MiB (0 to disable)',
+            default=64
+        )
+
         self.p.add_argument('-F', '--flat-library',
             action='store_true',
             help='store files in a flat library',
@@ -65,17 +135,138 @@ class Args:
             default=3.6
         )
 
+        self.p.add_argument('--snip-detect',
+            action='store_true',
+            help='find the intro / outro in the audio (decoding only the first and last few seconds), rather than snipping fixed lengths - needs NumPy'
+        )
+
+        self.p.add_argument('--mp3-intermediate',
+            type=str, action='store', choices=[ 'copy', 'vorbis' ],
+            help='how MP3 content is converted before it is split - "copy" remuxes it losslessly, "vorbis" encodes it twice',
+            default='copy'
+        )
+
+        self.p.add_argument('--normalize',
+            action='store_true',
+            help='measure the loudness of each whole book (EBU R128), and apply the same gain to all of its parts to meet --loudness-target (not for formats that copy the audio)'
+        )
+
+        self.p.add_argument('--loudness-target',
+            type=float, action='store',
+            help='the integrated loudness to normalize to, in LUFS',
+            default=-18.0
+        )
+
+        self.p.add_argument('--true-peak-max',
+            type=float, action='store',
+            help='never raise the gain so far that the true peak goes above this, in dBFS',
+            default=-1.0
+        )
+
+        self.p.add_argument('-S', '--single-pass',
+            action='store_true',
+            help='decode each input once, and write all of the chapters from a single ffmpeg process'
+        )
+
+        self.p.add_argument('-w', '--watch',
+            type=str, action='append', metavar='DIR',
+            help='keep running, and process new files as they appear in DIR (may be given more than once)',
+            default=[]
+        )
+
+        self.p.add_argument('--watch-settle',
+            type=float, action='store',
+            help='how many seconds a new file must be left unchanged before it is processed',
+            default=5.0
+        )
+
+        self.p.add_argument('--duplicates',
+            type=str, action='store', choices=[ 'skip', 'link', 'process' ],
+            help='what to do with a file whose book is already in the library - "skip" it, "link" it (replace it with a hard link to the library\'s copy, if it\'s identical), or "process" it again',
+            default='skip'
+        )
+
+        self.p.add_argument('--retries',
+            type=int, action='store',
+            help='how many times to retry a chapter that fails',
+            default=2
+        )
+
+        self.p.add_argument('--retry-backoff',
+            type=float, action='store',
+            help='how many seconds to wait before the first retry (doubling each time)',
+            default=5.0
+        )
+
+        self.p.add_argument('--timeout-factor',
+            type=float, action='store',
+            help='kill an ffmpeg process that runs for more than this many times longer than expected (0 to disable)',
+            default=10.0
+        )
+
+        self.p.add_argument('--timeout-min',
+            type=float, action='store',
+            help='never kill an ffmpeg process that has run for less than this many seconds',
+            default=300.0
+        )
+
+        self.p.add_argument('--retag',
+            action='store_true',
+            help='rewrite the tags of the Ogg (Vorbis / Opus) parts in the library from each book\'s metadata, without re-encoding them'
+        )
+
+        self.p.add_argument('--lookup',
+            type=str, action='append', metavar='BOOK_ID',
+            help='show what the library\'s catalog has for the book (by book ID, or product ID)',
+            default=[]
+        )
+
+        self.p.add_argument('--search',
+            type=str, action='store', metavar='TEXT',
+            help='list the books in the library\'s catalog whose title, author, narrator or series contains TEXT'
+        )
+
+        self.p.add_argument('--list',
+            action='store_true',
+            help='list all of the books in the library\'s catalog'
+        )
+
+        self.p.add_argument('--rebuild-catalog',
+            action='store_true',
+            help='rebuild the library\'s catalog from the files in the library'
+        )
+
+        self.p.add_argument('--metrics-log',
+            type=str, action='store', metavar='FILE',
+            help='append the timings (and resource usage) of each stage to FILE, as JSON lines'
+        )
+
+        self.p.add_argument('--metrics-textfile',
+            type=str, action='store', metavar='FILE',
+            help='keep running totals for each stage in FILE, for the Prometheus node_exporter textfile collector'
+        )
+
         self.p.add_argument('--debug',
             action='store_true',
             help='enable debug mode'
         )
 
         self.p.add_argument('files',
-            type=str, action='store',nargs='+', 
+            type=str, action='store',nargs='*', 
             help='the file(s) to convert'
         )
 
     def parse(self):
-        return self.p.parse_args()
+        args = self.p.parse_args()
+
+        commands = args.retag or args.rebuild_catalog or args.list or len(args.lookup) > 0 or args.search is not None
+        if len(args.files) == 0 and len(args.watch) == 0 and not commands:
+            self.p.error('the following arguments are required: files (or --watch, or a command)')
+
+        for d in args.watch:
+            if not os.path.isdir(d):
+                self.p.error('argument -w/--watch: not a directory: %s' % ( d ))
+
+        return args
 
 config = Args().parse()
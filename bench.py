@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+# benchmarks the split path (AaxInfo + AaxSplit) over synthetic, chaptered
+# audiobooks... e.g:
+#
+#   python3 -m aax_to_ogg.bench --length 60 --chapters 20 --save-baseline base.json
+#   python3 -m aax_to_ogg.bench --length 60 --chapters 20 --baseline base.json
+#
+# each run happens in its own process, with its own (empty) cache, so that
+# nothing is carried from one run to the next
+
+import os
+import sys
+import json
+import time
+import shlex
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+# name -> ( arguments, the fixtures that it applies to )
+CONFIGS = {
+    'default':     ( [],                                  ( 'm4a', 'mp3' ) ),
+    'single-pass': ( [ '-S' ],                            ( 'm4a', 'mp3' ) ),
+    'parallel-1':  ( [ '-p', '1' ],                       ( 'm4a', 'mp3' ) ),
+    'opus':        ( [ '-f', 'opus' ],                    ( 'm4a', 'mp3' ) ),
+    'copy':        ( [ '-f', 'm4a' ],                     ( 'm4a', 'mp3' ) ),
+    'mp3-vorbis':  ( [ '--mp3-intermediate', 'vorbis' ],  ( 'mp3', ) ),
+}
+
+# kind -> the arguments that encode it (always in to an MP4, as an AAX is)
+FIXTURES = {
+    'm4a': [ '-codec:a', 'aac', '-ab', '64k' ],
+    'mp3': [ '-codec:a', 'libmp3lame', '-ab', '64k' ],
+}
+
+def make_fixture(work_dir, kind, length, chapters):
+    # a tone with some noise on top (so the encoders have something to do),
+    # with evenly spaced chapters... they're kept, as they take a while
+    filename = os.path.join(work_dir, 'fixture_%s_%dm_%dc.mp4' % ( kind, length, chapters ))
+    if os.path.exists(filename):
+        return filename
+
+    duration = length * 60
+    chapter_len = duration / chapters
+
+    metadata = '%s.txt' % ( filename )
+    with open(metadata, 'w') as f:
+        f.write(';FFMETADATA1\n')
+        f.write('title=Benchmark (%s, %d minutes)\n' % ( kind, length ))
+        f.write('artist=aax_to_ogg\n')
+        for i in range(chapters):
+            f.write('[CHAPTER]\nTIMEBASE=1/1000\n')
+            f.write('START=%d\nEND=%d\n' % ( i * chapter_len * 1000, ( i + 1 ) * chapter_len * 1000 ))
+            f.write('title=Chapter %d\n' % ( i + 1 ))
+
+    args = [
+        'ffmpeg',
+        '-y',
+        '-loglevel', 'error',
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=44100:duration=%d' % ( duration ),
+        '-f', 'lavfi', '-i', 'anoisesrc=color=pink:sample_rate=44100:amplitude=0.1:duration=%d' % ( duration ),
+        '-i', metadata,
+        '-filter_complex', '[0:a][1:a]amix=inputs=2,aformat=channel_layouts=stereo[a]',
+        '-map', '[a]',
+        '-map_metadata', '2',
+        '-map_chapters', '2',
+        *FIXTURES[kind],
+        '-f', 'mp4',
+        '%s.tmp' % ( filename ),
+    ]
+
+    print('Generating [%s]...' % ( os.path.basename(filename) ))
+
+    p = subprocess.run(args, stdin=subprocess.DEVNULL)
+    os.remove(metadata)
+    if p.returncode != 0:
+        raise Exception('unable to generate the fixture...')
+
+    os.replace('%s.tmp' % ( filename ), filename)
+    return filename
+
+def worker(spec):
+    # runs in the child... the config is parsed from sys.argv when it is first
+    # imported, so that has to be in place beforehand
+    sys.argv = [ 'aax_to_ogg', '-c', spec['cache_dir'], *spec['args'], spec['filename'] ]
+
+    from aax_to_ogg.filetypes.aax import AaxInfo, AaxSplit
+    from aax_to_ogg.scheduler import Scheduler
+    from aax_to_ogg.governor import Governor
+    from aax_to_ogg.args import config
+
+    scheduler = Scheduler(config.parallel, net_workers=config.metadata_parallel, limit=Governor.concurrency, retry_backoff=config.retry_backoff)
+
+    i = AaxInfo(spec['filename'])
+    s = AaxSplit(i, scheduler, group=spec['filename'])
+    s.extract_chapters()
+
+    scheduler.join()
+    scheduler.close()
+
+    result = {
+        'audio_seconds': i.get_metadata()['duration'],
+        'errors': [ str(job.error) for job in scheduler.failures() ],
+    }
+    print(json.dumps(result))
+
+def run_one(work_dir, fixture, args):
+    # returns the measurements for one run of the split path over the fixture
+    run_dir = tempfile.mkdtemp(prefix='run_', dir=work_dir)
+    try:
+        filename = os.path.join(run_dir, 'B0BENCHMRK.aax')
+        shutil.copy(fixture, filename)
+
+        spec = {
+            'cache_dir': os.path.join(run_dir, 'cache'),
+            'args': args,
+            'filename': filename,
+        }
+
+        started = time.monotonic()
+        p = subprocess.Popen([ sys.executable, '-m', 'aax_to_ogg.bench', '--worker', json.dumps(spec) ], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+        stdout = p.stdout.read()
+        p.stdout.close()
+
+        # the rusage of the child includes the ffmpeg processes that it waited for
+        _, status, rusage = os.wait4(p.pid, 0)
+        p.returncode = os.waitstatus_to_exitcode(status)
+        wall = time.monotonic() - started
+
+        if p.returncode != 0:
+            raise Exception('the benchmark process failed... (exit code: %d)' % ( p.returncode ))
+
+        result = json.loads(stdout.decode('utf-8').strip().split('\n')[-1])
+        if len(result['errors']) > 0:
+            raise Exception('the split failed... %s' % ( result['errors'][0] ))
+
+        return {
+            'wall': wall,
+            'cpu': rusage.ru_utime + rusage.ru_stime,
+            'max_rss': rusage.ru_maxrss * 1024,
+            'throughput': result['audio_seconds'] / wall,
+        }
+    finally:
+        shutil.rmtree(run_dir)
+
+def summarize(runs):
+    # the median of each measurement, across the repeats
+    return { k: statistics.median(run[k] for run in runs) for k in runs[0] }
+
+def compare(results, baseline, tolerance):
+    # returns the names of the results that have regressed
+    regressions = []
+
+    for name, result in sorted(results.items()):
+        if name not in baseline['results']:
+            continue
+        base = baseline['results'][name]
+
+        slower = result['wall'] > base['wall'] * ( 1 + tolerance )
+        costlier = result['cpu'] > base['cpu'] * ( 1 + tolerance )
+
+        print('  %-24s wall %+6.1f%%  cpu %+6.1f%%  rss %+6.1f%%%s' % (
+            name,
+            100 * ( result['wall'] / base['wall'] - 1 ),
+            100 * ( result['cpu'] / base['cpu'] - 1 ),
+            100 * ( result['max_rss'] / base['max_rss'] - 1 ),
+            '  REGRESSION' if slower or costlier else '',
+        ))
+
+        if slower or costlier:
+            regressions.append(name)
+
+    return regressions
+
+def environment():
+    p = subprocess.run([ 'ffmpeg', '-version' ], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    return {
+        'cpu_count': os.cpu_count(),
+        'ffmpeg': p.stdout.decode('utf-8').split('\n')[0],
+        'python': sys.version.split()[0],
+    }
+
+def main():
+    p = argparse.ArgumentParser(prog='aax_to_ogg.bench', description='Benchmark the split path over synthetic audiobooks')
+
+    p.add_argument('-l', '--length', type=int, default=30,
+        help='the length of each fixture, in minutes')
+    p.add_argument('-n', '--chapters', type=int, default=10,
+        help='the number of chapters in each fixture')
+    p.add_argument('-k', '--fixture', action='append', choices=sorted(FIXTURES),
+        help='the fixtures to use (default: all)')
+    p.add_argument('-C', '--config', action='append',
+        help='the configurations to run, by name (%s) or as NAME=ARGS (default: all)' % ( ', '.join(CONFIGS) ))
+    p.add_argument('-r', '--repeat', type=int, default=3,
+        help='how many times to run each configuration (the median is reported)')
+    p.add_argument('-w', '--work-dir', default=os.path.join(tempfile.gettempdir(), 'aax_to_ogg_bench'),
+        help='where the fixtures are kept, and the runs happen')
+    p.add_argument('-b', '--baseline',
+        help='compare the results against this baseline, and fail if they have regressed')
+    p.add_argument('-t', '--tolerance', type=float, default=0.10,
+        help='how much slower than the baseline is tolerated, as a fraction')
+    p.add_argument('-s', '--save-baseline',
+        help='save the results as a baseline')
+    p.add_argument('--worker', help=argparse.SUPPRESS)
+
+    args = p.parse_args()
+
+    if args.worker is not None:
+        worker(json.loads(args.worker))
+        return 0
+
+    configs = {}
+    for c in args.config or CONFIGS:
+        if '=' in c:
+            name, c_args = c.split('=', 1)
+            configs[name] = ( shlex.split(c_args), tuple(FIXTURES) )
+        elif c in CONFIGS:
+            configs[c] = CONFIGS[c]
+        else:
+            p.error('unknown configuration: %s' % ( c ))
+
+    os.makedirs(args.work_dir, exist_ok=True)
+
+    fixtures = {
+        kind: make_fixture(args.work_dir, kind, args.length, args.chapters)
+        for kind in args.fixture or sorted(FIXTURES)
+    }
+
+    print('')
+    print('  %-24s %9s %9s %9s %12s' % ( 'name', 'wall (s)', 'cpu (s)', 'rss (MiB)', 'audio h / h' ))
+
+    results = {}
+    for kind, fixture in fixtures.items():
+        for c_name, ( c_args, kinds ) in configs.items():
+            if kind not in kinds:
+                continue
+
+            name = '%s/%s' % ( kind, c_name )
+            try:
+                runs = [ run_one(args.work_dir, fixture, c_args) for _ in range(args.repeat) ]
+            except Exception as e:
+                print('  %-24s ERROR: %s' % ( name, e ))
+                continue
+
+            results[name] = summarize(runs)
+            print('  %-24s %9.2f %9.2f %9.1f %12.1f' % (
+                name,
+                results[name]['wall'],
+                results[name]['cpu'],
+                results[name]['max_rss'] / ( 1024 * 1024 ),
+                results[name]['throughput'],
+            ))
+
+    current = {
+        'length': args.length,
+        'chapters': args.chapters,
+        'environment': environment(),
+        'results': results,
+    }
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(current, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+        print('')
+        print('Compared to [%s]...' % ( args.baseline ))
+
+        if ( baseline['length'], baseline['chapters'] ) != ( args.length, args.chapters ):
+            print('  WARNING: the baseline used %d minutes / %d chapters...' % ( baseline['length'], baseline['chapters'] ))
+        if baseline['environment'] != current['environment']:
+            print('  WARNING: the baseline was taken in a different environment... %s' % ( baseline['environment'] ))
+
+        if len(compare(results, baseline, args.tolerance)) > 0:
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    exit(main())
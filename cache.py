@@ -0,0 +1,82 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from aax_to_ogg.args import config
+
+def file_identity(filename, header_len=65536):
+    # identifies the content of a file, without reading all of it... the header
+    # hash catches files that are rewritten in place with the same size / mtime
+    st = os.stat(filename)
+
+    with open(filename, 'rb') as f:
+        header = hashlib.sha1(f.read(header_len)).hexdigest()
+
+    return '%d:%d:%d:%d:%s' % ( st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, header )
+
+class Store:
+    # a small key / value store, kept in the cache directory... values can be
+    # anything that will serialize as JSON
+    #
+    # if max_size is given (in bytes), then the least recently used entries are
+    # evicted to keep the store below that size
+    def __init__(self, name, max_size=None):
+        os.makedirs(config.cache_dir, exist_ok=True)
+        self.filename = os.path.join(config.cache_dir, '%s.sqlite' % ( name ))
+        self.max_size = max_size
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.filename, timeout=30, check_same_thread=False)
+
+        with self.lock, self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS store ( key TEXT PRIMARY KEY, value TEXT NOT NULL )')
+
+            # older stores won't have the bookkeeping columns
+            columns = [ row[1] for row in self.db.execute('PRAGMA table_info(store)') ]
+            if 'size' not in columns:
+                self.db.execute('ALTER TABLE store ADD COLUMN size INTEGER NOT NULL DEFAULT 0')
+            if 'accessed' not in columns:
+                self.db.execute('ALTER TABLE store ADD COLUMN accessed REAL NOT NULL DEFAULT 0')
+                self.db.execute('CREATE INDEX IF NOT EXISTS store_accessed ON store ( accessed )')
+
+    def get(self, key, default=None):
+        with self.lock, self.db:
+            row = self.db.execute('SELECT value FROM store WHERE key = ?', ( key, )).fetchone()
+            if row is not None and self.max_size is not None:
+                self.db.execute('UPDATE store SET accessed = ? WHERE key = ?', ( time.time(), key ))
+
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        value = json.dumps(value)
+
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO store ( key, value, size, accessed ) VALUES ( ?, ?, ?, ? )', ( key, value, len(value), time.time() ))
+            if self.max_size is not None:
+                self.evict()
+
+    def evict(self):
+        # called with the lock held, inside a transaction
+        total, = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM store').fetchone()
+        if total <= self.max_size:
+            return
+
+        for key, size in self.db.execute('SELECT key, size FROM store ORDER BY accessed ASC').fetchall():
+            if total <= self.max_size:
+                break
+            self.db.execute('DELETE FROM store WHERE key = ?', ( key, ))
+            total -= size
+
+    def delete(self, key):
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM store WHERE key = ?', ( key, ))
+
+    def values(self):
+        with self.lock:
+            rows = self.db.execute('SELECT value FROM store').fetchall()
+        return [ json.loads(row[0]) for row in rows ]
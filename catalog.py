@@ -0,0 +1,280 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from aax_to_ogg.args import config
+from aax_to_ogg.manifest import Manifest
+
+class Catalog:
+    # what is in the library... one row per book (its metadata, and where it
+    # is), its chapters (and the parts written for them), and the source files
+    # that it was made from. it lives in the library, as '.catalog.sqlite'
+    #
+    # each change to a book happens in a single transaction, so a book is
+    # never half recorded
+    catalog = None
+    catalog_lock = threading.Lock()
+
+    fields = ( 'title', 'author', 'narrator', 'publisher', 'release_date', 'series', 'series_book' )
+
+    schema = [
+        '''CREATE TABLE IF NOT EXISTS books (
+            book_id TEXT PRIMARY KEY,
+            product_id TEXT,
+            title TEXT,
+            author TEXT,
+            narrator TEXT,
+            publisher TEXT,
+            release_date TEXT,
+            series TEXT,
+            series_book,
+            path TEXT NOT NULL,
+            format TEXT,
+            duration REAL,
+            updated REAL NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS books_title ON books ( title COLLATE NOCASE )',
+        'CREATE INDEX IF NOT EXISTS books_author ON books ( author COLLATE NOCASE )',
+        'CREATE INDEX IF NOT EXISTS books_series ON books ( series COLLATE NOCASE, series_book )',
+        'CREATE INDEX IF NOT EXISTS books_product_id ON books ( product_id )',
+        '''CREATE TABLE IF NOT EXISTS chapters (
+            book_id TEXT NOT NULL,
+            num INTEGER NOT NULL,
+            title TEXT,
+            t_start REAL,
+            t_end REAL,
+            filename TEXT,
+            size INTEGER,
+            PRIMARY KEY ( book_id, num )
+        )''',
+        '''CREATE TABLE IF NOT EXISTS sources (
+            hash TEXT PRIMARY KEY,
+            book_id TEXT NOT NULL,
+            filename TEXT,
+            size INTEGER,
+            added REAL NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS sources_book_id ON sources ( book_id )',
+    ]
+
+    def __init__(self, filename):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        self.filename = filename
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, timeout=30, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+
+        with self.lock, self.db:
+            for statement in self.schema:
+                self.db.execute(statement)
+
+    @classmethod
+    def get_catalog(cls):
+        with cls.catalog_lock:
+            if cls.catalog is None:
+                cls.catalog = Catalog(os.path.join(config.library, '.catalog.sqlite'))
+            return cls.catalog
+
+    @staticmethod
+    def source_hash(filename, sample_len=1024 * 1024):
+        # identifies a source file by its size, and the start and end of its
+        # content... so that a copy is recognised wherever it is, without
+        # reading all of it
+        size = os.path.getsize(filename)
+
+        h = hashlib.sha1(b'%d:' % ( size ))
+        with open(filename, 'rb') as f:
+            h.update(f.read(sample_len))
+            if size > sample_len:
+                f.seek(max(sample_len, size - sample_len))
+                h.update(f.read(sample_len))
+
+        return h.hexdigest()
+
+    # ---
+
+    def add_book(self, book_id, book_metadata, path, product_id=None):
+        # called once the book's metadata is known, and it has a place in the
+        # library... the product ID is kept if it isn't known this time
+        with self.lock, self.db:
+            self._add_book(book_id, book_metadata, path, product_id)
+
+    def update_book(self, book_id, book_metadata=None, path=None, product_id=None, source=None, profile=None, duration=None, chapters=()):
+        # called once the parts have been written... the chapters are replaced
+        # as a whole (and the book is added too, given its metadata)
+        source_hash = None
+        if source is not None and os.path.exists(source):
+            source_hash = self.source_hash(source)
+
+        with self.lock, self.db:
+            if book_metadata is not None:
+                self._add_book(book_id, book_metadata, path, product_id)
+            self._update_book(book_id, source, source_hash, profile, duration, chapters)
+
+    def _add_book(self, book_id, book_metadata, path, product_id):
+        # called with the lock held, inside a transaction
+        values = [ book_metadata.get(field) for field in self.fields ]
+
+        self.db.execute(
+            'INSERT INTO books ( book_id, product_id, %s, path, updated ) VALUES ( ?, ?, %s, ?, ? ) '
+            'ON CONFLICT ( book_id ) DO UPDATE SET product_id = COALESCE(excluded.product_id, product_id), %s, path = excluded.path, updated = excluded.updated' % (
+                ', '.join(self.fields),
+                ', '.join('?' for _ in self.fields),
+                ', '.join('%s = excluded.%s' % ( field, field ) for field in self.fields),
+            ),
+            ( book_id, product_id, *values, path, time.time() )
+        )
+
+    def _update_book(self, book_id, source, source_hash, profile, duration, chapters):
+        # called with the lock held, inside a transaction
+        self.db.execute('UPDATE books SET format = ?, duration = ?, updated = ? WHERE book_id = ?', ( profile, duration, time.time(), book_id ))
+
+        self.db.execute('DELETE FROM chapters WHERE book_id = ?', ( book_id, ))
+        self.db.executemany(
+            'INSERT INTO chapters ( book_id, num, title, t_start, t_end, filename, size ) VALUES ( ?, ?, ?, ?, ?, ?, ? )',
+            [ ( book_id, c['num'], c['title'], c['t_start'], c['t_end'], c['filename'], c['size'] ) for c in chapters ]
+        )
+
+        if source_hash is not None:
+            self.db.execute(
+                'INSERT OR REPLACE INTO sources ( hash, book_id, filename, size, added ) VALUES ( ?, ?, ?, ?, ? )',
+                ( source_hash, book_id, os.path.abspath(source), os.path.getsize(source), time.time() )
+            )
+
+    # ---
+
+    def lookup(self, book_id):
+        # returns ( book, chapters ), or None... by book ID or product ID
+        with self.lock:
+            book = self.db.execute('SELECT * FROM books WHERE book_id = ? OR product_id = ?', ( book_id, book_id )).fetchone()
+            if book is None:
+                return None
+            chapters = self.db.execute('SELECT * FROM chapters WHERE book_id = ? ORDER BY num', ( book['book_id'], )).fetchall()
+
+        return dict(book), [ dict(chapter) for chapter in chapters ]
+
+    def search(self, text=None):
+        # every book whose title, author, narrator or series contains the text
+        # (or all of them)
+        query = 'SELECT * FROM books'
+        params = []
+
+        if text is not None:
+            like = '%%%s%%' % ( text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') )
+            query += ' WHERE ' + ' OR '.join('%s LIKE ? ESCAPE \'\\\'' % ( field ) for field in ( 'title', 'author', 'narrator', 'series' ))
+            params = [ like ] * 4
+
+        query += ' ORDER BY author COLLATE NOCASE, series COLLATE NOCASE, series_book, title COLLATE NOCASE'
+
+        with self.lock:
+            return [ dict(row) for row in self.db.execute(query, params) ]
+
+    def find_duplicate(self, source_hash, book_id=None):
+        # returns ( book, source ) for a book that has already been written
+        # from the same content (source is its row), or with the same book ID
+        # (source is None)... or None
+        with self.lock:
+            source = self.db.execute('SELECT * FROM sources WHERE hash = ?', ( source_hash, )).fetchone()
+            if source is not None:
+                book = self.db.execute('SELECT * FROM books WHERE book_id = ?', ( source['book_id'], )).fetchone()
+                if book is not None:
+                    return dict(book), dict(source)
+
+            if book_id is None:
+                return None
+
+            # a book only counts once its parts have been written
+            book = self.db.execute(
+                'SELECT * FROM books WHERE ( book_id = ? OR product_id = ? ) AND EXISTS ( SELECT 1 FROM chapters WHERE chapters.book_id = books.book_id )',
+                ( book_id, book_id )
+            ).fetchone()
+            if book is None:
+                return None
+
+        return dict(book), None
+
+    # ---
+
+    def rebuild(self, library, source_extensions):
+        # records everything that is in the library from scratch, from each
+        # book's '<book_id>.json' and manifest... the product IDs are kept, as
+        # they can't be found from the files. it all happens in one transaction,
+        # so the catalog can still be read (as it was) in the meantime... the
+        # sources are found by their extensions (see FileHandler)
+        books = []
+        for dirpath, dirnames, filenames in os.walk(library):
+            for filename in filenames:
+                match = re.match('^(?P<book_id>[a-zA-Z0-9]{10})\.json$', filename)
+                if match is None:
+                    continue
+                book_id = match.group('book_id')
+
+                try:
+                    with open(os.path.join(dirpath, filename), 'r') as f:
+                        book_metadata = json.load(f)
+                except ValueError:
+                    print('    NOTE: [%s] has broken metadata... skipping' % ( os.path.join(dirpath, filename) ))
+                    continue
+
+                info = self.from_manifest(dirpath, book_id, source_extensions)
+                if info['source'] is not None:
+                    info['source_hash'] = self.source_hash(info['source'])
+                books.append(( book_id, book_metadata, dirpath, info ))
+
+        with self.lock, self.db:
+            product_ids = { row['book_id']: row['product_id'] for row in self.db.execute('SELECT book_id, product_id FROM books') }
+
+            self.db.execute('DELETE FROM books')
+            self.db.execute('DELETE FROM chapters')
+            self.db.execute('DELETE FROM sources')
+
+            for book_id, book_metadata, path, info in books:
+                self._add_book(book_id, book_metadata, path, product_ids.get(book_id))
+                self._update_book(book_id, info['source'], info.get('source_hash'), info.get('profile'), info.get('duration'), info.get('chapters', ()))
+
+        return len(books)
+
+    @staticmethod
+    def from_manifest(book_dir, book_id, source_extensions):
+        # what update_book() would have been given, as far as the manifest (and
+        # the files) can tell
+        basename = os.path.join(book_dir, book_id)
+
+        source = None
+        for extension in source_extensions:
+            if os.path.exists('%s.%s' % ( basename, extension )):
+                source = '%s.%s' % ( basename, extension )
+
+        manifest_filename = '%s.manifest.json' % ( basename )
+        if not os.path.exists(manifest_filename):
+            return { 'source': source }
+
+        manifest = Manifest(manifest_filename)
+        parts = manifest.get('parts')
+        titles = { part['num']: part['title'] for part in manifest.get('plan') or [] }
+
+        chapters = []
+        profile = None
+        for key, record in sorted(parts.items(), key=lambda item: int(item[0])):
+            if record['status'] != 'done':
+                continue
+            profile = record['params']['profile']
+            chapters.append({
+                'num': int(key),
+                'title': titles.get(int(key)),
+                't_start': record['params']['t_start'],
+                't_end': record['params']['t_end'],
+                'filename': record['filename'],
+                'size': record['size'],
+            })
+
+        duration = None
+        if len(chapters) > 0:
+            duration = max(c['t_end'] for c in chapters) - min(c['t_start'] for c in chapters)
+
+        return { 'source': source, 'profile': profile, 'duration': duration, 'chapters': chapters }
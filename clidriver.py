@@ -1,23 +1,165 @@
 import os
+import time
+import signal
 
 from aax_to_ogg.args import config
 from aax_to_ogg.filehandler import FileHandler
+from aax_to_ogg.product import ProductHelper
+from aax_to_ogg.watch import Watcher
+from aax_to_ogg.retag import Retag
+from aax_to_ogg.catalog import Catalog
+from aax_to_ogg.util import seconds_to_human
+from aax_to_ogg.scheduler import JobFailed
+
+def handle_file(handler, filename):
+    print('Processing [%s]...' % ( filename ))
+
+    if not os.path.exists(filename):
+        print('   NOTE: %s doesn\'t exist...' % ( filename ))
+        return
+
+    try:
+        handler.handle_file(filename)
+    except Exception as e:
+        if config.debug:
+            raise
+        print('    ERROR: %s' % ( e ))
+
+def report(books):
+    # prints a summary of each book that has finished, and returns the jobs
+    # that failed
+    failures = []
+
+    for group, jobs in books.items():
+        failed = [ job for job in jobs if job.state == 'failed' and not isinstance(job.error, JobFailed) ]
+        skipped = [ job for job in jobs if job.state == 'failed' and isinstance(job.error, JobFailed) ]
+        retries = sum(max(0, job.attempts - 1) for job in jobs)
+
+        print('Finished [%s]... %d jobs done, %d failed, %d skipped, %d retries' % (
+            group, len(jobs) - len(failed) - len(skipped), len(failed), len(skipped), retries
+        ))
+        for job in failed:
+            print('    ERROR: [%s] %s' % ( job.label, job.error ))
+
+        failures.extend(failed)
+
+    return failures
+
+def watch(handler):
+    # returns the jobs that failed while watching
+    failures = []
+
+    def accept(filename):
+        try:
+            handler.get_file_handler(filename)
+        except Exception:
+            return False
+        return os.path.isfile(filename)
+
+    with Watcher(config.watch, accept, settle=config.watch_settle) as watcher:
+        # finish what has been started, but don't pick up anything new
+        def stop(signum, frame):
+            print('Draining... (%s)' % ( signal.Signals(signum).name ))
+            watcher.stop()
+
+            # a second signal is not so patient
+            signal.signal(signum, signal.SIG_DFL)
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        print('Watching [%s]...' % ( '], ['.join(watcher.dirs) ))
+
+        while not watcher.stopped:
+            for filename in watcher.poll():
+                handle_file(handler, filename)
+
+            failures.extend(report(handler.scheduler.reap()))
+
+            if handler.scheduler.is_idle():
+                ProductHelper.get_fetcher().forget()
+
+    return failures
+
+def print_books(books):
+    for book in books:
+        series = ''
+        if book['series'] is not None:
+            series = ' (%s%s)' % ( book['series'], '' if book['series_book'] is None else ', %s' % ( book['series_book'] ) )
+
+        print('%s  %s - %s%s' % ( book['book_id'], book['author'], book['title'], series ))
+        print('            %s' % ( book['path'] ))
+
+    print('%d books' % ( len(books) ))
+
+def print_book(book, chapters):
+    for key, value in book.items():
+        if key == 'duration' and value is not None:
+            value = seconds_to_human(value)
+        if key == 'updated':
+            value = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(value))
+        print('%14s: %s' % ( key, value ))
+
+    for chapter in chapters:
+        print('  #%03d  %10s  %10s  %-40s  %s (%s bytes)' % (
+            chapter['num'],
+            seconds_to_human(chapter['t_start']),
+            seconds_to_human(chapter['t_end'] - chapter['t_start']),
+            chapter['title'],
+            chapter['filename'],
+            chapter['size'],
+        ))
+
+def query():
+    # the catalog commands... answered from the catalog alone
+    if not ( config.rebuild_catalog or len(config.lookup) > 0 or config.search is not None or config.list ):
+        return
+
+    catalog = Catalog.get_catalog()
+
+    if config.rebuild_catalog:
+        print('Rebuilding the catalog of [%s]...' % ( config.library ))
+        print('%d books' % ( catalog.rebuild(config.library, FileHandler.source_extensions()) ))
+
+    for book_id in config.lookup:
+        found = catalog.lookup(book_id)
+        if found is None:
+            print('%s is not in the library...' % ( book_id ))
+            continue
+        print_book(*found)
+
+    if config.search is not None:
+        print_books(catalog.search(config.search))
+
+    if config.list:
+        print_books(catalog.search())
 
 def main():
+    if config.retag:
+        Retag.library(config.library)
+
+    query()
+
     handler = FileHandler()
 
     for filename in config.files:
-        print('Processing [%s]...' % ( filename ))
+        handle_file(handler, filename)
 
-        if not os.path.exists(filename):
-            print('   NOTE: %s doesn\'t exist...' % ( filename ))
-            continue
+    failures = []
+    if len(config.watch) > 0:
+        failures.extend(watch(handler))
 
-        try:
-            handler.handle_file(filename)
-        except Exception as e:
-            if config.debug:
-                raise
-            print('    ERROR: %s' % ( e ))
+    # the handlers only queue jobs... wait for all of them to finish
+    handler.scheduler.join()
+    handler.scheduler.close()
+
+    failures.extend(report(handler.scheduler.reap()))
+
+    if config.debug and len(failures) > 0:
+        raise failures[0].error
+
+    # a book with parts missing isn't finished
+    if len(failures) > 0:
+        return 1
 
     return 0
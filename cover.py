@@ -0,0 +1,143 @@
+import os
+import base64
+import struct
+import threading
+
+from aax_to_ogg.args import config
+from aax_to_ogg.mp4 import Mp4File, Mp4Error
+
+class CoverArt:
+    # the book's cover, as found in the MP4's 'covr' atom... it's kept in the
+    # cache by book ID, along with an ffmetadata file that carries it as a
+    # METADATA_BLOCK_PICTURE comment (too big to pass on the command line)
+    #
+    # the files are written through a '.tmp' file of the same name, so only
+    # one of them is written at a time
+    write_lock = threading.Lock()
+
+    extensions = {
+        'image/jpeg': 'jpg',
+        'image/png': 'png',
+    }
+
+    # the 'data' atom's type
+    data_types = {
+        13: 'image/jpeg',
+        14: 'image/png',
+    }
+
+    def __init__(self, book_id, mime, data):
+        self.book_id = book_id
+        self.mime = mime
+        self.data = data
+
+        self.extension = self.extensions[mime]
+        self.filename = self.cache_filename(book_id, self.extension)
+
+    @staticmethod
+    def cache_filename(book_id, extension):
+        return os.path.join(config.cache_dir, 'covers', '%s.%s' % ( book_id, extension ))
+
+    @classmethod
+    def load(cls, book_id, filename):
+        # returns the cover, or None if there isn't one (or we can't read it)
+        for mime, extension in cls.extensions.items():
+            cached = cls.cache_filename(book_id, extension)
+            if os.path.exists(cached):
+                with open(cached, 'rb') as f:
+                    return cls(book_id, mime, f.read())
+
+        try:
+            with Mp4File(filename) as f:
+                items = f.read_ilst()
+        except Mp4Error:
+            return None
+
+        if b'covr' not in items:
+            return None
+
+        data_type, data = items[b'covr']
+        mime = cls.data_types.get(data_type, cls.sniff(data))
+        if mime is None:
+            return None
+
+        cover = cls(book_id, mime, bytes(data))
+        cover.save(cover.filename)
+        return cover
+
+    @staticmethod
+    def sniff(data):
+        if data[:3] == b'\xff\xd8\xff':
+            return 'image/jpeg'
+        if data[:8] == b'\x89PNG\r\n\x1a\n':
+            return 'image/png'
+        return None
+
+    def save(self, filename):
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+
+        tmp = '%s.tmp' % ( filename )
+        with self.write_lock:
+            with open(tmp, 'wb') as f:
+                f.write(self.data)
+            os.replace(tmp, filename)
+
+    def dimensions(self):
+        # returns ( width, height, bits per pixel ), or zeros if we can't tell
+        data = self.data
+
+        if self.mime == 'image/png' and len(data) >= 26:
+            width, height, depth, color_type = struct.unpack_from('>IIBB', data, 16)
+            channels = { 0: 1, 2: 3, 3: 1, 4: 2, 6: 4 }.get(color_type, 1)
+            return width, height, depth * channels
+
+        if self.mime == 'image/jpeg':
+            # walk the segments, looking for the start of frame
+            pos = 2
+            while pos + 4 <= len(data) and data[pos] == 0xff:
+                marker = data[pos + 1]
+                length, = struct.unpack_from('>H', data, pos + 2)
+
+                if 0xc0 <= marker <= 0xcf and marker not in ( 0xc4, 0xc8, 0xcc ):
+                    if pos + 10 > len(data):
+                        break
+                    precision, height, width, components = struct.unpack_from('>BHHB', data, pos + 4)
+                    return width, height, precision * components
+
+                pos += 2 + length
+
+        return 0, 0, 0
+
+    def block_picture(self):
+        # the FLAC picture block, as used in a METADATA_BLOCK_PICTURE comment
+        mime = self.mime.encode('ascii')
+        width, height, depth = self.dimensions()
+
+        block = b''.join([
+            struct.pack('>II', 3, len(mime)), mime,         # front cover
+            struct.pack('>I', 0),                           # no description
+            struct.pack('>IIII', width, height, depth, 0),
+            struct.pack('>I', len(self.data)), self.data,
+        ])
+
+        return base64.b64encode(block).decode('ascii')
+
+    def ffmetadata_filename(self):
+        # written on first use... AaxSplit.extract_cover_art() writes it before
+        # any of the parts are started
+        filename = self.cache_filename(self.book_id, 'ffmetadata')
+
+        with self.write_lock:
+            if os.path.exists(filename):
+                return filename
+
+            # '=' (the base64 padding) needs escaping
+            value = self.block_picture().replace('=', '\\=')
+
+            tmp = '%s.tmp' % ( filename )
+            with open(tmp, 'w') as f:
+                f.write(';FFMETADATA1\n')
+                f.write('METADATA_BLOCK_PICTURE=%s\n' % ( value ))
+            os.replace(tmp, filename)
+
+        return filename
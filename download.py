@@ -0,0 +1,195 @@
+import os
+import re
+import json
+import time
+import threading
+import urllib.request
+
+class Downloader:
+    # downloads a URL using several HTTP Range requests at once... the data is
+    # written in to a preallocated '.part' file, and a '.part.json' sidecar
+    # records how far each range got, so that an interrupted download resumes
+    # from where it stopped
+    block_size = 256 * 1024
+    save_interval = 1.0
+
+    def __init__(self, url, target, headers={}, connections=4, progress=None):
+        self.url = url
+        self.target = target
+        self.headers = headers
+        self.connections = max(1, connections)
+        self.progress = progress
+
+        self.part_filename = '%s.part' % ( target )
+        self.state_filename = '%s.part.json' % ( target )
+
+        self.lock = threading.Lock()
+        self.state = None
+        self.saved_at = 0
+        self.errors = []
+
+    def open(self, start=None, end=None):
+        headers = dict(self.headers)
+        if start is not None:
+            headers['Range'] = 'bytes=%d-%s' % ( start, '' if end is None else '%d' % ( end - 1 ) )
+
+        req = urllib.request.Request(self.url, headers=headers)
+        return urllib.request.urlopen(req, timeout=60)
+
+    def get_size(self):
+        # returns the size, or None if the server can't do ranges for us
+        with self.open(0, 1) as resp:
+            if resp.status != 206:
+                return None
+
+            m = re.match('^bytes 0-0/(?P<size>[0-9]+)$', resp.getheader('Content-Range', ''))
+            if m is None:
+                return None
+
+            return int(m.group('size'))
+
+    def load_state(self, size):
+        if not os.path.exists(self.state_filename) or not os.path.exists(self.part_filename):
+            return None
+
+        try:
+            with open(self.state_filename, 'r') as f:
+                state = json.load(f)
+        except ValueError:
+            return None
+
+        if state.get('size') != size or os.path.getsize(self.part_filename) != size:
+            return None
+
+        return state
+
+    def save_state(self, force=False):
+        # called with the lock held
+        now = time.monotonic()
+        if not force and now - self.saved_at < self.save_interval:
+            return
+        self.saved_at = now
+
+        tmp = '%s.tmp' % ( self.state_filename )
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.state_filename)
+
+    def new_state(self, size):
+        step = -(-size // self.connections)
+        ranges = [
+            { 'start': start, 'end': min(start + step, size), 'pos': start }
+            for start in range(0, size, step)
+        ]
+
+        # preallocate the whole file up front
+        with open(self.part_filename, 'wb') as f:
+            if hasattr(os, 'posix_fallocate') and size > 0:
+                os.posix_fallocate(f.fileno(), 0, size)
+            else:
+                f.truncate(size)
+
+        return { 'url': self.url, 'size': size, 'ranges': ranges }
+
+    def report(self):
+        # called with the lock held
+        if self.progress is None:
+            return
+
+        done = sum(r['pos'] - r['start'] for r in self.state['ranges'])
+        self.progress(done, self.state['size'])
+
+    def fetch_range(self, fd, r):
+        try:
+            if r['pos'] >= r['end']:
+                return
+
+            with self.open(r['pos'], r['end']) as resp:
+                if resp.status != 206:
+                    raise Exception('server ignored our range request...')
+
+                while r['pos'] < r['end']:
+                    data = resp.read(min(self.block_size, r['end'] - r['pos']))
+                    if len(data) == 0:
+                        raise Exception('connection closed early... (%d bytes missing)' % ( r['end'] - r['pos'] ))
+
+                    os.pwrite(fd, data, r['pos'])
+
+                    with self.lock:
+                        r['pos'] += len(data)
+                        self.save_state()
+                        self.report()
+        except Exception as e:
+            with self.lock:
+                self.errors.append(e)
+
+    def fetch_whole(self, sink=None):
+        # a single, sequential connection in to the '.part' file... if given,
+        # sink() is also handed every byte in order
+        with self.open() as resp, open(self.part_filename, 'wb') as f:
+            size = int(resp.getheader('Content-Length', 0))
+            done = 0
+
+            while True:
+                data = resp.read(self.block_size)
+                if len(data) == 0:
+                    break
+                f.write(data)
+                if sink is not None:
+                    sink(data)
+
+                done += len(data)
+                if self.progress is not None and size > 0:
+                    self.progress(done, size)
+
+            if size > 0 and done != size:
+                raise Exception('download was truncated... (%d of %d bytes)' % ( done, size ))
+
+    def finish(self):
+        os.replace(self.part_filename, self.target)
+        if os.path.exists(self.state_filename):
+            os.remove(self.state_filename)
+
+        return self.target
+
+    def stream(self, sink):
+        # no ranges here, as sink() needs the bytes in order
+        self.fetch_whole(sink)
+        return self.finish()
+
+    def run(self):
+        size = self.get_size()
+
+        if size is None:
+            self.fetch_whole()
+        else:
+            self.state = self.load_state(size)
+            if self.state is None:
+                self.state = self.new_state(size)
+
+            with self.lock:
+                self.save_state(force=True)
+                self.report()
+
+            fd = os.open(self.part_filename, os.O_WRONLY)
+            try:
+                threads = [
+                    threading.Thread(target=self.fetch_range, args=( fd, r ), daemon=True)
+                    for r in self.state['ranges']
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+                with self.lock:
+                    self.save_state(force=True)
+
+            if len(self.errors) > 0:
+                raise Exception('download failed, it will resume next time... %s' % ( self.errors[0] ))
+
+        return self.finish()
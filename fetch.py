@@ -0,0 +1,176 @@
+import gzip
+import time
+from sys import stderr
+import threading
+import http.client
+import urllib.parse
+import urllib.request
+
+from aax_to_ogg.args import config
+from aax_to_ogg.cache import Store
+from aax_to_ogg.metrics import Metrics
+
+class Fetcher:
+    # keeps a connection open to each host (per thread), and remembers what it
+    # has parsed from each URL... both for this run, and on disk
+    user_agent = 'Python-urllib/%s' % ( urllib.request.__version__ )
+    max_redirects = 5
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+        # things that we've already seen in this run
+        self.bodies = {}
+        self.results = {}
+
+        # a lock for each URL (and result) in flight... so when several jobs
+        # want the same thing at once, one fetches it and the others wait for
+        # it, rather than each making the request
+        self.flights = {}
+
+        self.store = Store('http')
+
+    def get_connection(self, scheme, host, fresh=False):
+        connections = getattr(self.local, 'connections', None)
+        if connections is None:
+            connections = self.local.connections = {}
+
+        key = ( scheme, host )
+        if fresh and key in connections:
+            connections.pop(key).close()
+
+        if key not in connections:
+            if scheme == 'https':
+                connections[key] = http.client.HTTPSConnection(host, timeout=60)
+            else:
+                connections[key] = http.client.HTTPConnection(host, timeout=60)
+
+        return connections[key]
+
+    def request(self, url, headers):
+        # returns ( status, headers, body, url ), following any redirects
+        for _ in range(self.max_redirects + 1):
+            u = urllib.parse.urlsplit(url)
+            path = urllib.parse.urlunsplit(( '', '', u.path or '/', u.query, '' ))
+
+            req_headers = {
+                'User-Agent': self.user_agent,
+                'Accept-Encoding': 'gzip',
+                **headers,
+            }
+
+            # a kept-alive connection may have been closed by the server since
+            # we last used it... if so, try once more on a fresh connection
+            for fresh in ( False, True ):
+                conn = self.get_connection(u.scheme, u.netloc, fresh=fresh)
+                try:
+                    conn.request('GET', path, headers=req_headers)
+                    resp = conn.getresponse()
+                    body = resp.read()
+                    break
+                except ( http.client.RemoteDisconnected, http.client.CannotSendRequest, ConnectionError ):
+                    if fresh:
+                        raise
+
+            if resp.getheader('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+
+            if resp.status in ( 301, 302, 303, 307, 308 ) and resp.getheader('Location') is not None:
+                url = urllib.parse.urljoin(url, resp.getheader('Location'))
+                continue
+
+            return resp.status, resp, body, url
+
+        raise Exception('too many redirects... [%s]' % ( url ))
+
+    def flight(self, key):
+        with self.lock:
+            if key not in self.flights:
+                self.flights[key] = threading.Lock()
+            return self.flights[key]
+
+    def fetch(self, url, headers={}):
+        # returns ( status, validators, body ), never fetching a URL twice per run
+        with self.flight(( 'fetch', url )):
+            return self._fetch(url, headers)
+
+    def _fetch(self, url, headers):
+        with self.lock:
+            if url in self.bodies:
+                status, validators, body, req_headers = self.bodies[url]
+                # a 304 only answers the same conditional request
+                if status == 200 or req_headers == headers:
+                    return status, validators, body
+
+        if config.debug:
+            print('Fetching [%s]' % ( url ), file=stderr)
+
+        with Metrics.measure('fetch', url) as m:
+            status, resp, body, _ = self.request(url, headers)
+            m.extra.update({ 'http_status': status, 'body_bytes': len(body) })
+
+        validators = {
+            'etag': resp.getheader('ETag'),
+            'last_modified': resp.getheader('Last-Modified'),
+        }
+
+        if status not in ( 200, 304 ):
+            raise Exception('HTTP %d... [%s]' % ( status, url ))
+
+        with self.lock:
+            self.bodies[url] = ( status, validators, body, headers )
+
+        return status, validators, body
+
+    def forget(self):
+        # drops what has been seen in this run (the store on disk is kept)...
+        # a long running process calls this between books
+        with self.lock:
+            self.bodies.clear()
+            self.results.clear()
+            self.flights.clear()
+
+    def get(self, url, parse):
+        # returns parse(body) for the URL... results are stored on disk, and
+        # revalidated with the server once they expire
+        key = '%s %s' % ( parse.__qualname__, url )
+
+        with self.flight(( 'get', key )):
+            return self._get(url, parse, key)
+
+    def _get(self, url, parse, key):
+        with self.lock:
+            if key in self.results:
+                return self.results[key]
+
+        now = time.time()
+        entry = self.store.get(key)
+
+        if entry is not None and entry['expires'] > now:
+            result = entry['result']
+        else:
+            headers = {}
+            if entry is not None and entry['etag'] is not None:
+                headers['If-None-Match'] = entry['etag']
+            if entry is not None and entry['last_modified'] is not None:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+            status, validators, body = self.fetch(url, headers)
+
+            if status == 304:
+                result = entry['result']
+                validators = { k: v if v is not None else entry[k] for k, v in validators.items() }
+            else:
+                result = parse(body)
+
+            self.store.set(key, {
+                'expires': now + config.http_cache_ttl * 86400,
+                **validators,
+                'result': result,
+            })
+
+        with self.lock:
+            self.results[key] = result
+
+        return result
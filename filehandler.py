@@ -1,18 +1,34 @@
+import os
+import filecmp
 from os import path
 from glob import glob
 from importlib import import_module
 
 from aax_to_ogg.args import config
+from aax_to_ogg.scheduler import Scheduler
+from aax_to_ogg.governor import Governor
+from aax_to_ogg.catalog import Catalog
 
 FT_MODULE_BASE = 'aax_to_ogg.filetypes'
 
 class FileHandler:
     def __init__(self):
+        self.plugins = self.load_plugins()
+
+        # the sources (and book IDs) handled during this run, as the catalog
+        # only learns of them once their parts have been written
+        self.seen = {}
+
+        # all of the work for all of the files is queued here
+        self.scheduler = Scheduler(config.parallel, net_workers=config.metadata_parallel, limit=Governor.concurrency, retry_backoff=config.retry_backoff)
+
+    @staticmethod
+    def load_plugins():
         # load each of the filetype plugins...
         filetypes_path = import_module(FT_MODULE_BASE).__path__._path[0]
         plugin_names = [ name for name in glob(path.join(filetypes_path, '*.py')) ]
 
-        self.plugins = []
+        plugins = []
         for plugin in [ name.rsplit(path.sep, 1)[-1].rsplit('.', 1)[0] for name in plugin_names ]:
             module_name = '%s.%s' % ( FT_MODULE_BASE, plugin )
             class_name = 'FileHandler_%s' % ( plugin )
@@ -25,7 +41,18 @@ class FileHandler:
                 raise
                 continue
 
-            self.plugins.append(ft_class)
+            plugins.append(ft_class)
+
+        return plugins
+
+    @classmethod
+    def source_extensions(cls):
+        # what a book's source can be called in the library, once a plugin has
+        # put it there (e.g: '<book_id>.aax')
+        extensions = []
+        for plugin in cls.load_plugins():
+            extensions.extend(e for e in plugin.source_extensions if e not in extensions)
+        return extensions
 
     def get_file_handler(self, filename):
         for plugin in self.plugins:
@@ -40,4 +67,55 @@ class FileHandler:
         plugin = self.get_file_handler(filename)
 
         p = plugin(self, filename)
+        if self.is_duplicate(p):
+            return
+
         p.process()
+
+    def is_duplicate(self, p):
+        # checked before any of the work is queued... a copy of a book that is
+        # already in the library (by its content, or its book ID) is skipped,
+        # or replaced with a hard link to the library's copy
+        if config.duplicates == 'process':
+            return False
+
+        source_hash = Catalog.source_hash(p.filename)
+        book_id = p.get_book_id()
+
+        for key in ( source_hash, book_id ):
+            if key is not None and key in self.seen:
+                print('    NOTE: a duplicate of [%s]... skipping' % ( self.seen[key] ))
+                return True
+
+        found = Catalog.get_catalog().find_duplicate(source_hash, book_id)
+        if found is None:
+            self.seen[source_hash] = p.filename
+            if book_id is not None:
+                self.seen[book_id] = p.filename
+            return False
+
+        book, source = found
+        print('    NOTE: %s is already in the library, as [%s]... skipping' % ( book['book_id'], book['path'] ))
+
+        if config.duplicates == 'link' and source is not None:
+            self.link(p.filename, source['filename'])
+
+        return True
+
+    @staticmethod
+    def link(filename, target):
+        # the content is the same, so only one copy needs to take up space...
+        # the hash only covers part of it, so it's all compared first
+        if not os.path.exists(target) or os.path.samefile(filename, target):
+            return
+        if not filecmp.cmp(filename, target, shallow=False):
+            print('    NOTE: [%s] differs from [%s]... not linking' % ( filename, target ))
+            return
+
+        tmp = '%s.tmp' % ( filename )
+        try:
+            os.link(target, tmp)
+        except OSError as e:
+            print('    NOTE: unable to link to [%s]... %s' % ( target, e ))
+            return
+        os.replace(tmp, filename)
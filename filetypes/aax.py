@@ -4,29 +4,60 @@ import os
 import re
 import json
 import shutil
+import struct
+import threading
 import subprocess
-from multiprocessing import Pool
 from pprint import pprint
-from aax_to_ogg.util import tell_bounds, human_to_seconds
+from aax_to_ogg.util import tell_bounds, human_to_seconds, seconds_to_human
 
 from aax_to_ogg.args import config
 from aax_to_ogg.product import ProductHelper
 from aax_to_ogg.library import Library
+from aax_to_ogg.catalog import Catalog
+from aax_to_ogg.cache import Store, file_identity
+from aax_to_ogg.activation import ActivationHelper
+from aax_to_ogg.mp4 import Mp4File, Mp4Error
+from aax_to_ogg.profiles import PROFILES
+from aax_to_ogg.manifest import Manifest
+from aax_to_ogg.cover import CoverArt
+from aax_to_ogg.snip import SnipDetector
+from aax_to_ogg.loudness import Loudness
+from aax_to_ogg.metrics import Metrics, Measurement
+from aax_to_ogg.retag import Retag
+from aax_to_ogg.oggtag import OggError
+from aax_to_ogg import process
 
 class FileHandler_aax:
+    # what the file is called once it's in the library (see FileHandler)
+    source_extensions = ( 'aax', )
+
     @staticmethod
     def can_handle_file(filename):
         return re.match('^(?P<book_id>[a-zA-Z0-9]{10})(_ep[56])?\.aax$', os.path.basename(filename))
 
-    def __init__(self, file_handler, filename):
+    def __init__(self, file_handler, filename, group=None):
         if not self.can_handle_file(filename):
             raise Exception('cannot handle the given file...')
 
         self.file_handler = file_handler
         self.filename = filename
 
+        # the file moves in to the library, but its jobs are reported (and
+        # reaped) together under the name that it was found with
+        self.group = filename if group is None else group
+
+    def get_book_id(self):
+        return self.can_handle_file(self.filename).groupdict()['book_id']
+
     def process(self):
-        book_id = self.can_handle_file(self.filename).groupdict()['book_id']
+        book_id = self.get_book_id()
+
+        scheduler = self.file_handler.scheduler
+        job = scheduler.submit('metadata', self.store, book_id, label=book_id, group=self.group)
+
+        self.split(deps=[ job ])
+
+    def store(self, book_id):
         book_metadata = ProductHelper.get_book_metadata(config.domain, book_id)
         book_path = Library.make_book_absdir(book_metadata)
 
@@ -34,29 +65,49 @@ class FileHandler_aax:
         with open(metadata, 'w') as f:
             json.dump(book_metadata, f)
 
+        Catalog.get_catalog().add_book(book_id, book_metadata, book_path)
+
         filename_new = os.path.join(book_path, '%s.aax' % ( book_id ))
         shutil.move(self.filename, filename_new)
         self.filename = filename_new
 
-        self.split()
-
     # ---
 
-    def split(self):
+    def split(self, deps=(), converted=None):
+        # 'converted' is the whole file's intermediate, if it was converted
+        # while downloading... see AaxStream
+        scheduler = self.file_handler.scheduler
+        return scheduler.submit('probe', self._split, converted, deps=deps, label=os.path.basename(self.filename), group=self.group)
+
+    def _split(self, converted):
         basename, _ = os.path.splitext(self.filename)
 
         i = AaxInfo(self.filename)
-        s = AaxSplit(i)
+        s = AaxSplit(i, self.file_handler.scheduler, group=self.group)
 
         with open('%s.txt' % ( basename ), 'wb') as f:
             for line in i.get_output():
                 f.write(line.encode('utf-8'))
                 f.write(b'\r\n')
 
+        # this is quick (unless it has to fall back to ffmpeg), and the
+        # chapters need it before they start
         s.extract_cover_art()
-        s.extract_chapters()
+        s.extract_chapters(converted=converted)
 
 class AaxInfo:
+    re_input    = re.compile('^Input #[0-9]+')
+    re_metadata = re.compile('^  Metadata:$')
+    re_duration = re.compile('^  Duration: (?P<duration>[0-9:\.]+), start: (?P<t_start>[0-9]+(?:\.[0-9]+)?), bitrate: (?P<bitrate>[0-9]+) kb/s')
+    re_chapter  = re.compile('^    Chapter #(?P<chapter_id>[0-9]+(:[0-9]+)?): start (?P<t_start>[0-9]+(?:\.[0-9]+)?), end (?P<t_end>[0-9]+(?:\.[0-9]+)?)$')
+    re_title    = re.compile('^      title +: (?P<title>.+)$')
+    re_stream   = re.compile('^    Stream #(?P<stream_id>[0-9]+(:[0-9]+)?)(\((?P<lang>[^\)]+)\))?: (?P<type>[^:]+): (?P<format>.+)$')
+    re_mp3      = re.compile('^(?P<codec>mp3), (?P<sample_rate>[0-9]+) Hz, (?P<channels>stereo|mono), (?P<sample_shape>(s|u)(8|16|24|32)p?), (?P<bitrate>[0-9]+) kb/s')
+    re_aac      = re.compile('^(?P<codec>aac) \(LC\) \(aavd / 0x[0-9a-fA-F]+\), (?P<sample_rate>[0-9]+) Hz, (?P<channels>stereo|mono), (?P<sample_shape>((s|u)(8|16|24|32)|flt)p?), (?P<bitrate>[0-9]+) kb/s')
+
+    probe_store = None
+    probe_store_lock = threading.Lock()
+
     def __init__(self, filename):
         self.filename = filename
 
@@ -89,7 +140,124 @@ class AaxInfo:
             } ]
         return self.chapters
 
+    @classmethod
+    def get_probe_store(cls):
+        # maps the file's identity to everything that we learned by probing it
+        with cls.probe_store_lock:
+            if cls.probe_store is None:
+                cls.probe_store = Store('probe', max_size=config.probe_cache_size * 1024 * 1024)
+            return cls.probe_store
+
     def run(self):
+        with Metrics.measure('probe', self.filename) as m:
+            m.extra['cached'] = self._run()
+            m.audio_seconds = self.metadata.get('duration')
+
+    def _run(self):
+        # returns True if the probe cache had it
+        if config.probe_cache_size <= 0:
+            self.probe()
+            return False
+
+        key = file_identity(self.filename)
+        store = self.get_probe_store()
+
+        cached = store.get(key)
+        if cached is not None:
+            self.metadata = cached['metadata']
+            self.chapters = cached['chapters']
+            self.streams = cached['streams']
+            self.lines = cached['lines']
+            self.state = 0
+            return True
+
+        self.probe()
+
+        store.set(key, {
+            'metadata': self.metadata,
+            'chapters': self.chapters,
+            'streams': self.streams,
+            'lines': self.lines,
+        })
+
+        return False
+
+    def probe(self):
+        try:
+            with Mp4File(self.filename) as f:
+                info = f.probe()
+        except Mp4Error:
+            # not something that we can read ourselves... ask ffprobe
+            self.run_ffprobe()
+            return
+
+        self.load(info)
+
+    def load(self, info):
+        # fill in the same structures that the ffprobe parser would
+        self.metadata = { **info['metadata'], 'bitrate': info['bitrate'], 'duration': info['duration'] }
+
+        self.streams = {}
+        for i, stream in enumerate(info['streams']):
+            stream_id = '0:%d' % ( i )
+            tag = '%s / 0x%08x' % ( stream['format'], int.from_bytes((stream['format'] or '').encode('latin-1'), 'little') )
+
+            self.streams[stream_id] = {
+                'stream_id': stream_id,
+                'lang': stream['language'],
+                'type': stream['type'],
+                'format': '(%s)' % ( tag ),
+            }
+
+            if stream.get('codec') not in ( 'aac', 'mp3' ):
+                continue
+
+            codec = {
+                'codec': stream['codec'],
+                'sample_rate': '%d' % ( stream['sample_rate'] ),
+                'channels': { 1: 'mono', 2: 'stereo' }.get(stream['channels'], '%d channels' % ( stream['channels'] )),
+                'sample_shape': 'fltp',
+                'bitrate': '%d' % ( stream['bitrate'] ),
+            }
+            self.streams[stream_id][stream['codec']] = codec
+            self.streams[stream_id]['format'] = '%(codec)s (%(tag)s), %(sample_rate)s Hz, %(channels)s, %(sample_shape)s, %(bitrate)s kb/s' % ( { **codec, 'tag': tag } )
+
+        self.chapters = []
+        for i, chapter in enumerate(info['chapters']):
+            self.chapters.append({
+                'chapter_id': '0:%d' % ( i ),
+                't_start': chapter['t_start'],
+                't_end': chapter['t_end'],
+                'title': chapter['title'],
+            })
+
+        self.lines = self.format_output()
+        self.state = 0
+
+    def format_output(self):
+        # something that looks like ffprobe's output, for the '.txt' file
+        lines = [ 'Input #0, mov,mp4,m4a,3gp,3g2,mj2, from \'%s\':' % ( self.filename ) ]
+
+        lines.append('  Metadata:')
+        for key, value in self.metadata.items():
+            if key in ( 'bitrate', 'duration' ):
+                continue
+            lines.append('    %-16s: %s' % ( key, value ))
+
+        lines.append('  Duration: %s, start: 0.000000, bitrate: %d kb/s' % ( seconds_to_human(self.metadata['duration']), self.metadata['bitrate'] ))
+
+        for chapter in self.chapters:
+            lines.append('    Chapter #%s: start %.6f, end %.6f' % ( chapter['chapter_id'], chapter['t_start'], chapter['t_end'] ))
+            if chapter['title'] is not None:
+                lines.append('      Metadata:')
+                lines.append('        title           : %s' % ( chapter['title'] ))
+
+        for stream in self.streams.values():
+            lines.append('    Stream #%s(%s): %s: %s' % ( stream['stream_id'], stream['lang'], stream['type'], stream['format'] ))
+
+        return lines
+
+    def run_ffprobe(self):
         args = [
             'ffprobe',
             self.filename
@@ -101,7 +269,7 @@ class AaxInfo:
             'stderr': subprocess.PIPE
         }
 
-        p = subprocess.run(args, **kwargs)
+        p = process.run(args, **kwargs)
         # it runs to completion!
 
         stderr = p.stderr.decode('utf-8')
@@ -122,21 +290,21 @@ class AaxInfo:
 
     def _state_0(self, line):
         # look for the beginning of the interesting stuff
-        if re.match('^Input #[0-9]+', line):
+        if self.re_input.match(line):
             self.state = 1
 
         # prevent the other states from being run
         return True
 
     def _state_1(self, line):
-        if re.match('^  Metadata:$', line):
+        if self.re_metadata.match(line):
             # this means we're in the "metadata" section...
             self.state = 2
-        elif re.match('^  Duration: ', line):
+        elif line.startswith('  Duration: '):
             # this means we're in the "chapter" section..."
             self.state = 3
 
-            m = re.match('^  Duration: (?P<duration>[0-9:\.]+), start: (?P<t_start>[0-9]+(?:\.[0-9]+)?), bitrate: (?P<bitrate>[0-9]+) kb/s', line)
+            m = self.re_duration.match(line)
             if m is not None:
                 m = m.groupdict()
                 self.metadata['bitrate'] = int(m['bitrate'])
@@ -153,7 +321,7 @@ class AaxInfo:
 
     def _state_3(self, line):
         # process chapter information
-        m = re.match('^    Chapter #(?P<chapter_id>[0-9]+(:[0-9]+)?): start (?P<t_start>[0-9]+(?:\.[0-9]+)?), end (?P<t_end>[0-9]+(?:\.[0-9]+)?)$', line)
+        m = self.re_chapter.match(line)
         if m is not None:
             m = m.groupdict()
             self.chapters.append({
@@ -163,26 +331,33 @@ class AaxInfo:
                 'title': None, # we just give it a NULL title for now
             })
 
-        m = re.match('^      title +: (?P<title>.+)$', line)
+        m = self.re_title.match(line)
         if m is not None:
             # ah hah! now the title is filled in
             self.chapters[-1] = { **self.chapters[-1], **m.groupdict() }
 
-        m = re.match('^    Stream #(?P<stream_id>[0-9]+(:[0-9]+)?)(\((?P<lang>[^\)]+)\))?: (?P<type>[^:]+): (?P<format>.+)$', line)
+        m = self.re_stream.match(line)
         if m is not None:
             stream = m.groupdict()
-            m = re.match('^(?P<codec>mp3), (?P<sample_rate>[0-9]+) Hz, (?P<channels>stereo|mono), (?P<sample_shape>(s|u)(8|16|24|32)p?), (?P<bitrate>[0-9]+) kb/s', stream['format'])
+            m = self.re_mp3.match(stream['format'])
             if m is not None:
                 stream['mp3'] = m.groupdict()
-            m = re.match('^(?P<codec>aac) \(LC\) \(aavd / 0x[0-9a-fA-F]+\), (?P<sample_rate>[0-9]+) Hz, (?P<channels>stereo|mono), (?P<sample_shape>((s|u)(8|16|24|32)|flt)p?), (?P<bitrate>[0-9]+) kb/s', stream['format'])
+            m = self.re_aac.match(stream['format'])
             if m is not None:
                 stream['aac'] = m.groupdict()
 
             self.streams[stream['stream_id']] = stream
 
 class AaxSplit:
-    def __init__(self, aax_info):
+    # how quickly each profile encodes each codec (seconds of audio per CPU
+    # second), learned from the chapters that have been extracted before
+    speed_store = None
+    speed_store_lock = threading.Lock()
+
+    def __init__(self, aax_info, scheduler, group=None):
         self.aax_info = aax_info
+        self.scheduler = scheduler
+        self.group = group
         self.basename, _ = os.path.splitext(self.aax_info.filename)
 
         m = aax_info.get_metadata()
@@ -193,7 +368,137 @@ class AaxSplit:
 
         self.activation_bytes = self.pick_activation_bytes()
 
+        if 'mp3' in aax_info.streams.get('0:0', {}):
+            self.codec = 'mp3'
+        else:
+            self.codec = 'aac'
+        self.profile = PROFILES[config.format].for_codec(self.codec)
+
+        self.manifest = Manifest('%s.manifest.json' % ( self.basename ))
+
+        # see extract_cover_art()
+        self.cover = None
+
+        # the book's metadata is stored next to it (see FileHandler_aax.store),
+        # and the parts are tagged with it as they are written
+        self.book_metadata = None
+        if os.path.exists('%s.json' % ( self.basename )):
+            with open('%s.json' % ( self.basename ), 'r') as f:
+                self.book_metadata = json.load(f)
+
+        # see _extract_chapters()
+        self.titles = {}
+        self.tracks = {}
+
+        # the intro / outro lengths... see detect_snip()
+        self.snip = ( config.snip_intro_len, config.snip_outro_len )
+
+        # the whole book's loudness, once it is known... see measure_loudness()
+        self.loudness = None
+
+    def part_filename(self, num):
+        return '%s_part%03d.%s' % ( self.basename, num, self.profile.extension )
+
+    def part_params(self, input_filename, t_start, t_end):
+        # everything that goes in to a part... if any of this changes, then the
+        # part needs to be written again
+        params = {
+            'input': os.path.basename(input_filename),
+            't_start': round(t_start, 6),
+            't_end': round(t_end, 6),
+            'bitrate': self.bitrate,
+            'profile': self.profile.name,
+            'snip': None if config.no_snip else list(self.snip),
+        }
+
+        if self.should_normalize():
+            params['gain'] = Loudness.gain(self.loudness)
+
+        return params
+
+    def _pending_parts(self, input_filename, plan):
+        pending = []
+
+        for part in plan:
+            params = self.part_params(input_filename, part['t_start'], part['t_end'])
+            if self.manifest.is_done(part['num'], params, self.part_filename(part['num'])):
+                continue
+            pending.append(part)
+
+        return pending
+
+    @classmethod
+    def get_speed_store(cls):
+        with cls.speed_store_lock:
+            if cls.speed_store is None:
+                cls.speed_store = Store('speed')
+            return cls.speed_store
+
+    def speed_key(self):
+        return '%s:%s' % ( self.profile.name, self.codec )
+
+    def predict_cost(self, seconds):
+        # the CPU seconds that we expect it to take... until this profile has
+        # been seen, assume that it's as fast as the others
+        store = self.get_speed_store()
+
+        speed = store.get(self.speed_key())
+        if speed is None:
+            speeds = store.values()
+            speed = sum(speeds) / len(speeds) if len(speeds) > 0 else 1.0
+
+        return seconds / speed
+
+    def job_timeout(self, seconds):
+        # a generous multiple of how long we expect it to take... anything
+        # longer than that has most likely hung
+        if config.timeout_factor <= 0:
+            return None
+        return max(config.timeout_min, self.predict_cost(seconds) * config.timeout_factor)
+
+    @staticmethod
+    def timed_out(p):
+        # for the error messages
+        return ' (timed out)' if p.timed_out else ''
+
+    def learn_speed(self, seconds, cpu):
+        # very short parts are mostly start-up costs, and tell us little
+        if seconds < 10 or cpu <= 0:
+            return
+
+        store = self.get_speed_store()
+        key = self.speed_key()
+
+        speed = seconds / cpu
+        prev = store.get(key)
+        if prev is not None:
+            speed = 0.8 * prev + 0.2 * speed
+
+        store.set(key, speed)
+
     def pick_activation_bytes(self):
+        with Metrics.measure('activation', self.group):
+            return self._pick_activation_bytes()
+
+    def _pick_activation_bytes(self):
+        try:
+            with Mp4File(self.aax_info.filename) as f:
+                checksum = f.adrm_checksum()
+        except Mp4Error:
+            # we can't read this ourselves... leave it to ffmpeg
+            return self.trial_activation_bytes()
+
+        if checksum is None:
+            # not encrypted
+            return None
+
+        ab = ActivationHelper.resolve(checksum)
+        if ab is None:
+            raise Exception('unable to decrypt AAX... missing activation bytes... (checksum: %s)' % ( checksum.hex() ))
+
+        return ab
+
+    def trial_activation_bytes(self):
         for ab in [ None, *config.activation_bytes ]:
             if self.test_activation_bytes(ab):
                 return ab
@@ -225,10 +530,35 @@ class AaxSplit:
             'stderr': subprocess.DEVNULL
         }
 
-        p = subprocess.run(args, **kwargs)
+        p = process.run(args, **kwargs)
         return p.returncode == 0
 
-    def extract_cover_art(self):
+    def extract_cover_art(self, scheduler=None):
+        if scheduler is not None:
+            return scheduler.submit('cover', self.extract_cover_art, label='%s.jpg' % ( os.path.basename(self.basename) ), group=self.group)
+
+        with Metrics.measure('cover', self.group):
+            # straight from the 'covr' atom (or the cache) if we can
+            self.cover = CoverArt.load(os.path.basename(self.basename), self.aax_info.filename)
+            if self.cover is not None:
+                self.cover.save('%s.%s' % ( self.basename, self.cover.extension ))
+
+                # the parts all read it, so it's written before they start
+                if self.profile.picture == 'comment':
+                    self.cover.ffmetadata_filename()
+                return
+
+            if not self.is_mp4():
+                self.extract_cover_art_ffmpeg()
+
+    def is_mp4(self):
+        try:
+            with Mp4File(self.aax_info.filename):
+                return True
+        except Mp4Error:
+            return False
+
+    def extract_cover_art_ffmpeg(self):
         args = [
             'ffmpeg',
             '-y',
@@ -244,111 +574,633 @@ class AaxSplit:
             'stderr': subprocess.DEVNULL
         }
 
-        p = subprocess.run(args, **kwargs)
+        p = process.run(args, **kwargs)
 
-    def _extract_chapters(self, input_filename, chapters):
-        pool = Pool(processes=config.parallel)
+    def cover_args(self, input_num, picture=True):
+        # returns ( inputs, output options ) that take the audio and metadata
+        # from the first input, and embed the cover (as input 'input_num')... the Ogg formats carry it as a comment, the others as
+        # an attached picture
+        options = [
+            '-map', '0:a',
+            '-map_metadata', '0',
+        ]
+
+        if self.cover is None or not picture:
+            return [], options
+
+        if self.profile.picture == 'comment':
+            return [ '-i', self.cover.ffmetadata_filename() ], [
+                *options,
+                '-map_metadata:s:a', '%d:g' % ( input_num ),
+            ]
+
+        return [ '-i', self.cover.filename ], [
+            *options,
+            '-map', '%d:v' % ( input_num ),
+            '-codec:v', 'copy',
+            '-disposition:v', 'attached_pic',
+        ]
+
+    def _plan_chapters(self, chapters):
+        # work out the parts that we'll write, including the snipped intro /
+        # outro... each part is numbered as it will appear in the filename
+        plan = []
 
         for i, first, last, chapter in tell_bounds(chapters):
+            part = {
+                'num': i + 1,
+                't_start': chapter['t_start'],
+                't_end': chapter['t_end'],
+                'title': chapter['title'],
+            }
+
             if not config.no_snip:
                 if first:
-                    chapter['t_start'] += config.snip_intro_len
-                    self.extract_chapter(input_filename, i, 0, chapter['t_start'], 'This is Audible', pool=pool)
+                    part['t_start'] += self.snip[0]
+                    plan.append({ 'num': 0, 't_start': 0, 't_end': part['t_start'], 'title': 'This is Audible' })
                 if last:
-                    t = chapter['t_end'] - config.snip_outro_len
-                    self.extract_chapter(input_filename, i + 2, t, chapter['t_end'], 'Audible hopes you have enjoied...', pool=pool)
-                    chapter['t_end'] = t
+                    t = part['t_end'] - self.snip[1]
+                    plan.append({ 'num': i + 2, 't_start': t, 't_end': part['t_end'], 'title': 'Audible hopes you have enjoied...' })
+                    part['t_end'] = t
 
-            self.extract_chapter(input_filename, i + 1, chapter['t_start'], chapter['t_end'], chapter['title'], pool=pool)
+            plan.append(part)
 
-        pool.close()
-        pool.join()
+        return sorted(plan, key=lambda part: part['num'])
 
-    def extract_chapters(self):
+    def detect_snip(self, input_filename, chapters):
+        # finds the intro / outro in the audio, rather than using the fixed
+        # lengths (see SnipDetector)... if input_filename is None, then only
+        # what was found before is used
+        if config.no_snip or not config.snip_detect or len(chapters) == 0:
+            return
+
+        if not SnipDetector.available():
+            print('    NOTE: NumPy is not installed... using the fixed snip lengths')
+            return
+
+        book_id = os.path.basename(self.basename)
+
+        if input_filename is None:
+            found = SnipDetector.cached(book_id)
+        else:
+            # (only the edges are decoded)
+            timeout = self.job_timeout(2 * SnipDetector.edge_len)
+            try:
+                with Metrics.measure('snip', self.group):
+                    found = SnipDetector.detect(book_id, input_filename, self.input_activation_bytes(input_filename), chapters[0]['t_start'], chapters[-1]['t_end'], timeout=timeout)
+            except Exception as e:
+                print('    NOTE: %s using the fixed snip lengths' % ( e ))
+                return
+
+        if found is None:
+            return
+
+        intro, outro = found
+        if intro is None or outro is None:
+            print('    NOTE: the %s wasn\'t found... using the fixed length' % ( 'intro' if intro is None else 'outro' ))
+
+        self.snip = (
+            config.snip_intro_len if intro is None else intro,
+            config.snip_outro_len if outro is None else outro,
+        )
+
+    def should_normalize(self):
+        # the audio can't be changed without re-encoding it
+        return config.normalize and not self.profile.copy
+
+    def cached_loudness(self):
+        # measured once per book, from whichever input was read in full first
+        loudness = self.manifest.get('loudness')
+        if loudness is None or loudness['source'] != os.path.basename(self.aax_info.filename):
+            return None
+        return loudness
+
+    def set_loudness(self, loudness):
+        self.loudness = dict(loudness, source=os.path.basename(self.aax_info.filename))
+        self.manifest.set('loudness', self.loudness)
+
+        gain = Loudness.gain(loudness)
+        print('    Loudness... %.1f LUFS, true peak %.1f dBFS (gain: %s)' % ( loudness['integrated'], loudness['true_peak'], 'none' if gain is None else '%+.2f dB' % ( gain ) ))
+
+    def measure_loudness(self, input_filename, scheduler=None):
+        if scheduler is not None:
+            return scheduler.submit('loudness', self.measure_loudness, input_filename, label=os.path.basename(self.basename), group=self.group, retries=config.retries)
+
+        duration = self.aax_info.get_metadata().get('duration', 0)
+
+        with Metrics.measure('loudness', self.group, duration):
+            loudness = Loudness.measure(input_filename, self.input_activation_bytes(input_filename), timeout=self.job_timeout(duration))
+
+        self.set_loudness(loudness)
+
+    def gain_args(self):
+        # every part gets the same gain, worked out for the whole book
+        gain = Loudness.gain(self.loudness) if self.should_normalize() else None
+        if gain is None:
+            return []
+        return [ '-filter:a', 'volume=%.2fdB' % ( gain ) ]
+
+    def _extract_chapters(self, input_filename, chapters):
+        # returns the jobs that will write the parts
+        self.manifest.set('chapters', chapters)
+        self.detect_snip(input_filename, chapters)
+
+        # the parts can't start until the whole book's loudness is known
+        deps = []
+        if config.normalize and self.profile.copy:
+            print('    NOTE: "%s" copies the audio, so it can\'t be normalized...' % ( self.profile.name ))
+        elif self.should_normalize():
+            self.loudness = self.cached_loudness()
+            if self.loudness is None:
+                deps = [ self.measure_loudness(input_filename, scheduler=self.scheduler) ]
+
+        plan = self._plan_chapters(chapters)
+
+        # the titles are kept for retagging the parts later on
+        self.manifest.set('plan', [ { 'num': part['num'], 'title': part['title'] } for part in plan ])
+        self.titles = { part['num']: part['title'] for part in plan }
+        self.tracks = Retag.tracks(plan)
+
+        # anything that a previous run finished can be left alone
+        pending = self._pending_parts(input_filename, plan)
+        if len(pending) < len(plan):
+            print('    Skipping %d of %d parts... (already done)' % ( len(plan) - len(pending), len(plan) ))
+        plan_all, plan = plan, pending
+
+        if len(plan) == 0:
+            return [ self.update_catalog(plan_all, scheduler=self.scheduler) ]
+
+        # (the segment muxer falls back to fixed length segments when it has no
+        # boundaries, so a lone part is extracted on its own)
+        if config.single_pass and len(plan) > 1 and self.can_extract_single_pass(plan):
+            jobs = [ self.extract_single_pass(input_filename, plan, deps=deps, scheduler=self.scheduler) ]
+            return [ *jobs, self.update_catalog(plan_all, deps=jobs, scheduler=self.scheduler) ]
+
+        # the idle workers pick up each job as soon as it is submitted, so the
+        # longest go in first
+        jobs = []
+        for part in sorted(plan, key=lambda part: part['t_end'] - part['t_start'], reverse=True):
+            jobs.append(self.extract_chapter(input_filename, part['num'], part['t_start'], part['t_end'], part['title'], deps=deps, scheduler=self.scheduler))
+
+        return [ *jobs, self.update_catalog(plan_all, deps=jobs, scheduler=self.scheduler) ]
+
+    def extract_chapters(self, converted=None):
         if 'mp3' in self.aax_info.streams['0:0']:
             # for some reason seeking doesn't work properly, and we end up with
-            # garbled output... to resolve this, convert the whole file first...
-            input_filename = self.convert_whole(self.aax_info.filename)
-
-            # this also means that the file's runtime can be different... up to
-            # ~2 minutes in some cases...
-            chapters = AaxInfo(input_filename).get_chapters()
-            tidy_input_file = True
+            # garbled output... to resolve this, convert the whole file first.
+            # by default the MP3 stream is copied in to Matroska (which seeks
+            # accurately), so it's only encoded once - by the chapter jobs
+            if converted is None:
+                converted = self.intermediate_filename(self.basename)
+
+                # if a previous run wrote all of the parts, then there's no
+                # need to make the intermediate again
+                chapters = self.manifest.get('chapters')
+                # (the parts' params include the snip and the gain, so both
+                # have to be as they were when the parts were written)
+                if chapters is not None:
+                    self.detect_snip(None, chapters)
+                if self.should_normalize():
+                    self.loudness = self.cached_loudness()
+                if chapters is not None and len(self._pending_parts(converted, self._plan_chapters(chapters))) == 0:
+                    print('    Skipping all parts... (already done)')
+                    return
+
+                deps = [ self.convert_whole(self.aax_info.filename, scheduler=self.scheduler) ]
+            else:
+                deps = []
+            self.scheduler.submit('probe', self._extract_converted_chapters, converted, deps=deps, label=os.path.basename(self.basename), group=self.group)
         else:
-            input_filename = self.aax_info.filename
+            self._extract_chapters(self.aax_info.filename, self.aax_info.get_chapters())
+
+    def _extract_converted_chapters(self, input_filename):
+        # a copy keeps the original's timeline, so its chapters still hold...
+        # but re-encoding can change the runtime (by up to ~2 minutes in some
+        # cases), so the Vorbis intermediate has to be probed again (by
+        # ffprobe, as it isn't an MP4)
+        if config.mp3_intermediate == 'copy':
             chapters = self.aax_info.get_chapters()
-            tidy_input_file = False
+        else:
+            chapters = AaxInfo(input_filename).get_chapters()
+        jobs = self._extract_chapters(input_filename, chapters)
 
-        self._extract_chapters(input_filename, chapters)
+        # tidy the input file once all of the parts have been written
+        self.scheduler.submit('tidy', os.remove, input_filename, deps=jobs, label=os.path.basename(input_filename), group=self.group)
 
-        if tidy_input_file:
-            os.remove(input_filename)
+    def update_catalog(self, plan, deps=(), scheduler=None):
+        if scheduler is not None:
+            return scheduler.submit('catalog', self.update_catalog, plan, deps=deps, label=os.path.basename(self.basename), group=self.group)
 
-    def extract_chapter(self, input_filename, num, t_start, t_end, title, pool=None):
-        if pool is not None:
-            pool.apply_async(self.extract_chapter, (input_filename, num, t_start, t_end, title))
+        # only books that are in the library are catalogued (see
+        # FileHandler_aax.store)
+        if self.book_metadata is None:
             return
 
+        parts = self.manifest.get('parts')
+
+        chapters = []
+        for part in plan:
+            record = parts.get('%d' % ( part['num'] ))
+            if record is None or record['status'] != 'done':
+                continue
+            chapters.append({
+                'num': part['num'],
+                'title': part['title'],
+                't_start': part['t_start'],
+                't_end': part['t_end'],
+                'filename': record['filename'],
+                'size': record['size'],
+            })
+
+        Catalog.get_catalog().update_book(
+            os.path.basename(self.basename),
+            book_metadata=self.book_metadata,
+            path=os.path.dirname(self.aax_info.filename),
+            source=self.aax_info.filename,
+            profile=self.profile.name,
+            duration=self.aax_info.get_metadata().get('duration'),
+            chapters=chapters,
+        )
+
+    def input_activation_bytes(self, input_filename):
+        # an intermediate file has already been decrypted, and the other
+        # demuxers will refuse the option
+        if input_filename != self.aax_info.filename:
+            return None
+        return self.activation_bytes
+
+    def extract_chapter(self, input_filename, num, t_start, t_end, title, deps=(), scheduler=None):
+        if scheduler is not None:
+            cost = self.predict_cost(t_end - t_start)
+            return scheduler.submit('chapter', self.extract_chapter, input_filename, num, t_start, t_end, title, deps=deps, label='%s #%d' % ( os.path.basename(self.basename), num ), group=self.group, cost=cost, retries=config.retries)
+
+        # write to a temporary name, so that a part that exists is complete
+        params = self.part_params(input_filename, t_start, t_end)
+        output_filename = self.part_filename(num)
+        tmp_filename = '%s.tmp' % ( output_filename )
+
+        args = self.extract_args(input_filename, num, t_start, t_end, tmp_filename)
+
+        kwargs = {
+            'stdin': subprocess.DEVNULL,
+            'stdout': subprocess.DEVNULL,
+            'timeout': self.job_timeout(t_end - t_start),
+        }
+
+        print('    Extracting #%d... (%s)' % ( num, title ))
+
+        with Metrics.measure('chapter', self.group, t_end - t_start, num=num) as m:
+            p = process.run(args, **kwargs)
+            m.extra['returncode'] = p.returncode
+
+        if p.returncode == 0:
+            self.learn_speed(t_end - t_start, m.cpu)
+
+        if p.returncode != 0:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            self.manifest.mark(num, params, 'failed')
+            raise Exception('Extract chapter #%d failed...%s' % ( num, self.timed_out(p) ))
+
+        os.replace(tmp_filename, output_filename)
+        self.manifest.mark(num, params, 'done', output_filename)
+
+    def tags(self, num=None):
+        if self.book_metadata is None:
+            return {}
+        return Retag.tags(self.book_metadata, self.tracks.get(num), self.titles.get(num), len(self.tracks))
+
+    def tag_args(self, num=None):
+        args = []
+        for key, value in self.tags(num).items():
+            if value is not None:
+                args.extend([ '-metadata', '%s=%s' % ( key, value ) ])
+        return args
+
+    def extract_args(self, input_filename, num, t_start, t_end, output_filename):
+        activation_bytes = self.input_activation_bytes(input_filename)
+        cover_inputs, cover_options = self.cover_args(1)
+
         args = [
             'ffmpeg',
             '-y',
             '-loglevel', 'error',
         ]
-        if self.activation_bytes is not None:
+        if activation_bytes is not None:
             args.extend([
-                '-activation_bytes', self.activation_bytes,
+                '-activation_bytes', activation_bytes,
             ])
         args.extend([
             '-accurate_seek',
             '-ss', '%.6f' % ( t_start ),
             '-i', input_filename,
+            *cover_inputs,
             '-to', '%.6f' % ( t_end - t_start ),
-            '-vn',
-            '-codec:a', 'libvorbis',
-            '-ab', '%dk' % ( self.bitrate ),
-            '%s_part%03d.ogg' % ( self.basename, num )
+            *cover_options,
+            *self.tag_args(num),
+            *self.gain_args(),
+            *self.profile.output_args(self.bitrate),
+            output_filename
+        ])
+
+        return args
+
+    @staticmethod
+    def can_extract_single_pass(plan):
+        # the segment muxer can only write contiguous, sequentially numbered
+        # parts... anything else needs to be extracted one part at a time
+        for prev, part in zip(plan, plan[1:]):
+            if part['num'] != prev['num'] + 1:
+                return False
+            if abs(part['t_start'] - prev['t_end']) > 0.001:
+                return False
+        return True
+
+    def extract_single_pass(self, input_filename, plan, deps=(), scheduler=None):
+        if scheduler is not None:
+            cost = self.predict_cost(plan[-1]['t_end'] - plan[0]['t_start'])
+            return scheduler.submit('split', self.extract_single_pass, input_filename, plan, deps=deps, label=os.path.basename(self.basename), group=self.group, cost=cost, retries=config.retries)
+
+        # decode (and decrypt) the input just once, and let the segment muxer
+        # cut it up at the part boundaries... timestamps are relative to the
+        # start of the first part
+        t_base = plan[0]['t_start']
+        segment_times = [ '%.6f' % ( part['t_start'] - t_base ) for part in plan[1:] ]
+
+        activation_bytes = self.input_activation_bytes(input_filename)
+
+        # the segment muxer passes the metadata on to each part, but not an
+        # attached picture... so only a comment can carry the cover here
+        cover_inputs, cover_options = self.cover_args(1, picture=self.profile.picture == 'comment')
+
+        args = [
+            'ffmpeg',
+            '-y',
+            '-loglevel', 'error',
+        ]
+        if activation_bytes is not None:
+            args.extend([
+                '-activation_bytes', activation_bytes,
+            ])
+        args.extend([
+            '-ss', '%.6f' % ( t_base ),
+            '-i', input_filename,
+            *cover_inputs,
+            '-t', '%.6f' % ( plan[-1]['t_end'] - t_base ),
+            *cover_options,
+            *self.tag_args(),
+            *self.gain_args(),
+            *self.profile.codec_args(self.bitrate),
+            '-f', 'segment',
+            '-segment_format', self.profile.muxer,
+            '-segment_start_number', '%d' % ( plan[0]['num'] ),
+            '-reset_timestamps', '1',
+        ])
+        if len(segment_times) > 0:
+            args.extend([
+                '-segment_times', ','.join(segment_times),
+            ])
+        args.extend([
+            '%s_part%%03d.%s.tmp' % ( self.basename, self.profile.extension ),
         ])
 
         kwargs = {
             'stdin': subprocess.DEVNULL,
-            'stdout': subprocess.DEVNULL
+            'stdout': subprocess.DEVNULL,
+            'timeout': self.job_timeout(plan[-1]['t_end'] - t_base),
         }
 
-        print('    Extracting #%d... (%s)' % ( num, title ))
+        print('    Extracting %d parts in a single pass...' % ( len(plan) ))
+
+        with Metrics.measure('split', self.group, plan[-1]['t_end'] - t_base, parts=len(plan)) as m:
+            p = process.run(args, **kwargs)
+            m.extra['returncode'] = p.returncode
+
+        for part in plan:
+            params = self.part_params(input_filename, part['t_start'], part['t_end'])
+            output_filename = self.part_filename(part['num'])
+            tmp_filename = '%s.tmp' % ( output_filename )
+
+            if p.returncode != 0:
+                if os.path.exists(tmp_filename):
+                    os.remove(tmp_filename)
+                self.manifest.mark(part['num'], params, 'failed')
+                continue
+
+            # every part gets the same metadata from the segment muxer... the
+            # Ogg formats can have theirs fixed up without another pass
+            if self.book_metadata is not None and self.profile.muxer in ( 'ogg', 'opus' ):
+                try:
+                    Retag.part(tmp_filename, self.tags(part['num']))
+                except OggError as e:
+                    print('    NOTE: unable to tag part #%d... %s' % ( part['num'], e ))
+
+            os.replace(tmp_filename, output_filename)
+            self.manifest.mark(part['num'], params, 'done', output_filename)
+
+        if p.returncode != 0:
+            raise Exception('Extract single pass failed...%s' % ( self.timed_out(p) ))
+
+    def convert_whole(self, input_filename, scheduler=None):
+        if scheduler is not None:
+            return scheduler.submit('convert', self.convert_whole, input_filename, label=os.path.basename(self.basename), group=self.group)
+
+        output_filename = self.intermediate_filename(self.basename)
+        args = self.convert_whole_args(input_filename, output_filename, self.activation_bytes, self.bitrate)
+
+        kwargs = {
+            'stdin': subprocess.DEVNULL,
+            'stdout': subprocess.DEVNULL,
+            'timeout': self.job_timeout(self.aax_info.get_metadata().get('duration', 0)),
+        }
+
+        # this reads the whole book anyway, so the loudness is measured in the
+        # same pass (its summary is only logged at the 'info' level)... it's
+        # the first output, so that the intermediate stays last, where the
+        # governor's output options go (see Governor.ffmpeg_args)
+        measure = self.should_normalize() and self.cached_loudness() is None
+        if measure:
+            args[args.index('-loglevel') + 1] = 'info'
+            args[1:1] = [ '-nostats' ]
+            pos = args.index('-i') + 2
+            args[pos:pos] = Loudness.output_args()
+            kwargs['stderr'] = subprocess.PIPE
+
+        print('    Converting Whole...')
+
+        with Metrics.measure('convert', self.group, self.aax_info.get_metadata().get('duration')) as m:
+            p = process.run(args, **kwargs)
+            m.extra['returncode'] = p.returncode
 
-        p = subprocess.run(args, **kwargs)
         if p.returncode != 0:
-            raise Exception('Extract whole failed...')
+            raise Exception('Convert whole failed...%s' % ( self.timed_out(p) ))
 
-    def convert_whole(self, input_filename):
-        output_filename = '%s.ogg' % ( self.basename )
+        if measure:
+            loudness = Loudness.parse(p.stderr)
+            if loudness is not None:
+                self.set_loudness(loudness)
 
+        return output_filename
+
+    @staticmethod
+    def intermediate_filename(basename):
+        if config.mp3_intermediate == 'copy':
+            return '%s.mka' % ( basename )
+        return '%s.ogg' % ( basename )
+
+    @staticmethod
+    def convert_whole_args(input_filename, output_filename, activation_bytes, bitrate):
         args = [
             'ffmpeg',
             '-y',
             '-loglevel', 'error',
         ]
-        if self.activation_bytes is not None:
+        if activation_bytes is not None:
             args.extend([
-                '-activation_bytes', self.activation_bytes,
+                '-activation_bytes', activation_bytes,
             ])
         args.extend([
             '-i', input_filename,
             '-vn',
-            '-codec:a', 'libvorbis',
-            '-ab', '%dk' % ( self.bitrate ),
+        ])
+        if config.mp3_intermediate == 'copy':
+            # lossless, and very cheap... the chapters come along too
+            args.extend([
+                '-codec:a', 'copy',
+                '-f', 'matroska',
+            ])
+        else:
+            args.extend([
+                '-codec:a', 'libvorbis',
+                '-ab', '%dk' % ( bitrate ),
+            ])
+        args.extend([
             output_filename
         ])
 
+        return args
+
+class AaxStream:
+    # converts an AAX (see convert_whole) while it is still being downloaded... this
+    # is given every byte of the download in order, and once the 'moov' box has
+    # arrived, we know enough to start ffmpeg and feed it the rest through a
+    # pipe. if anything gets in the way (e.g: the 'mdat' box comes first, or it
+    # isn't MP3), then we give up and the whole file is converted afterwards
+    def __init__(self, basename):
+        self.basename = basename
+        self.output_filename = AaxSplit.intermediate_filename(basename)
+
+        self.head = bytearray()
+        self.proc = None
+        self.failed = False
+        self.measurement = None
+
+    def __call__(self, data):
+        if self.failed:
+            return
+
+        try:
+            if self.proc is None:
+                self.head += data
+                if not self.start():
+                    return
+                data, self.head = bytes(self.head), None
+
+            self.proc.stdin.write(data)
+        except ( Mp4Error, OSError ) as e:
+            if config.debug:
+                print('    NOTE: not converting while downloading... %s' % ( e ))
+            self.abandon()
+
+    def find_moov(self):
+        # returns the end of the 'moov' box, once all of it has arrived
+        pos = 0
+        while pos + 8 <= len(self.head):
+            size, box_type = struct.unpack_from('>I4s', self.head, pos)
+            if size == 1:
+                if pos + 16 > len(self.head):
+                    return None
+                size, = struct.unpack_from('>Q', self.head, pos + 8)
+
+            if box_type == b'mdat':
+                raise Mp4Error('the media data comes before the movie header...')
+            if size < 8:
+                raise Mp4Error('invalid box...')
+            if box_type == b'moov':
+                return pos + size if pos + size <= len(self.head) else None
+
+            pos += size
+
+        return None
+
+    def start(self):
+        # returns True once ffmpeg is running
+        moov_end = self.find_moov()
+        if moov_end is None:
+            return False
+
+        # the header on its own is enough for the box reader
+        head_filename = '%s.head.mp4' % ( self.basename )
+        with open(head_filename, 'wb') as f:
+            f.write(self.head[:moov_end])
+        try:
+            with Mp4File(head_filename) as f:
+                info = f.probe()
+                checksum = f.adrm_checksum()
+        finally:
+            os.remove(head_filename)
+
+        audio = [ stream for stream in info['streams'] if stream['type'] == 'Audio' ]
+        if len(audio) == 0 or audio[0]['codec'] != 'mp3':
+            raise Mp4Error('only MP3 content is converted while downloading...')
+
+        activation_bytes = None
+        if checksum is not None:
+            activation_bytes = ActivationHelper.resolve(checksum)
+            if activation_bytes is None:
+                raise Mp4Error('missing activation bytes...')
+
+        args = AaxSplit.convert_whole_args('pipe:0', self.output_filename, activation_bytes, audio[0]['bitrate'] or config.bitrate)
+
         kwargs = {
-            'stdin': subprocess.DEVNULL,
+            'stdin': subprocess.PIPE,
             'stdout': subprocess.DEVNULL
         }
 
-        print('    Converting Whole...')
+        print('    Converting Whole while downloading...')
 
-        p = subprocess.run(args, **kwargs)
-        if p.returncode != 0:
-            raise Exception('Extract whole failed...')
+        self.measurement = Measurement('convert', self.basename, info['duration'], streamed=True)
+        self.proc = process.popen(args, **kwargs)
+        return True
 
-        return output_filename
+    def abandon(self):
+        self.failed = True
+        self.head = None
+
+        if self.proc is not None:
+            self.proc.kill()
+            self.proc.wait()
+            self.proc = None
+
+            if os.path.exists(self.output_filename):
+                os.remove(self.output_filename)
+
+    def finish(self):
+        # returns the converted file, or None if it needs to be done afterwards
+        if self.failed or self.proc is None:
+            return None
+
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+
+        returncode = process.wait(self.proc, self.measurement.started)
+        self.measurement.add(self.proc.usage)
+        Metrics.record(self.measurement, 'ok' if returncode == 0 else 'failed')
+
+        if returncode != 0:
+            self.abandon()
+            return None
+
+        return self.output_filename
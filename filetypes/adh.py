@@ -3,16 +3,29 @@
 import json
 import shutil
 import os.path
-import urllib.request
 from pprint import pprint
 from collections import OrderedDict
 from progressbar import ProgressBar, Percentage, Bar, AdaptiveETA
 
+from aax_to_ogg.args import config
+from aax_to_ogg.util import console_lock
+from aax_to_ogg.download import Downloader
 from aax_to_ogg.product import ProductHelper
 from aax_to_ogg.library import Library
-from aax_to_ogg.filetypes.aax import FileHandler_aax
+from aax_to_ogg.catalog import Catalog
+from aax_to_ogg.filetypes.aax import FileHandler_aax, AaxStream
 
 class FileHandler_adh:
+    supported_awtypes = {
+        'aax': 'aax'
+    }
+    supported_codecs = {
+        'mp332': 'mp332'
+    }
+
+    # what the download is called in the library (see FileHandler)
+    source_extensions = ( *supported_awtypes.values(), *supported_codecs.values() )
+
     @staticmethod
     def can_handle_file(filename):
         if filename[-4:] != '.adh':
@@ -20,19 +33,22 @@ class FileHandler_adh:
 
         return True
 
-    def __init__(self, file_handler, filename):
+    def __init__(self, file_handler, filename, group=None):
         if not self.can_handle_file(filename):
             raise Exception('cannot handle the given file...')
 
         self.file_handler = file_handler
         self.filename = filename
 
-        self.supported_awtypes = {
-            'aax': 'aax'
-        }
-        self.supported_codecs = {
-            'mp332': 'mp332'
-        }
+        # see FileHandler_aax... the downloaded file's jobs are in the same group
+        self.group = filename if group is None else group
+
+    def get_book_id(self):
+        # (the product ID, which the catalog knows too)
+        product_id = self.parse().get('product_id', 'null')
+        if product_id == 'null':
+            return None
+        return product_id
 
     def process(self):
         info = self.parse()
@@ -43,6 +59,11 @@ class FileHandler_adh:
         if 'product_id' not in info:
             raise Exception('unknown product_id...')
 
+        scheduler = self.file_handler.scheduler
+        job = scheduler.submit('metadata', self.store, info, label=os.path.basename(self.filename), group=self.group)
+        scheduler.submit('download', self.fetch, info, deps=[ job ], label=os.path.basename(self.filename), group=self.group)
+
+    def store(self, info):
         if info['product_id'] != 'null':
             search_term = info['product_id']
         else:
@@ -51,12 +72,14 @@ class FileHandler_adh:
         book_id = ProductHelper.search_for_book_id(info['domain'], search_term)
 
         if info['product_id'] != book_id:
-            print('search for "%s" returned book ID: %s ... is this correct?' % ( search_term, book_id ))
-            print('visit: %s' % ( ProductHelper.get_book_url(info['domain'], book_id) ))
+            # other jobs are printing too... hold the console while we ask
+            with console_lock:
+                print('search for "%s" returned book ID: %s ... is this correct?' % ( search_term, book_id ))
+                print('visit: %s' % ( ProductHelper.get_book_url(info['domain'], book_id) ))
 
-            response = None
-            while response not in [ 'y', 'n' ]:
-                response = input('[y/n]: ').lower()
+                response = None
+                while response not in [ 'y', 'n' ]:
+                    response = input('[y/n]: ').lower()
 
             if response != 'y':
                 raise Exception('incorrect book ID located...')
@@ -73,16 +96,33 @@ class FileHandler_adh:
         with open(metadata, 'w') as f:
             json.dump(book_metadata, f)
 
+        Catalog.get_catalog().add_book(book_id, book_metadata, book_path, product_id=info['product_id'])
+
         filename_new = os.path.join(book_path, '%s.adh' % ( book_id ))
         shutil.move(self.filename, filename_new)
         self.filename = filename_new
 
-        new_filename = self.download(info)
+    def fetch(self, info):
+        converted = None
+
+        if config.stream and info.get('codec', '').lower() in self.supported_codecs:
+            # MP3 content gets converted as it arrives
+            basename, _ = os.path.splitext(self.filename)
+            stream = AaxStream(basename)
+
+            try:
+                new_filename = self.download(info, sink=stream)
+            except:
+                stream.abandon()
+                raise
+            converted = stream.finish()
+        else:
+            new_filename = self.download(info)
 
         plugin = self.file_handler.get_file_handler(new_filename)
 
-        p = plugin(self.file_handler, new_filename)
-        p.split()
+        p = plugin(self.file_handler, new_filename, group=self.group)
+        p.split(converted=converted)
 
     # ---
 
@@ -112,7 +152,7 @@ class FileHandler_adh:
 
         return extension
 
-    def download(self, info):
+    def download(self, info, sink=None):
         extension = self.check_compatibility(info)
 
         basename, _ = os.path.splitext(self.filename)
@@ -121,6 +161,10 @@ class FileHandler_adh:
         if os.path.exists(target):
             raise Exception('target file aready exists... %s' % ( target ))
 
+        if sink is not None and os.path.exists('%s.part.json' % ( target )):
+            # we can't stream from the middle... resume the ranged download
+            sink = None
+
         url = ProductHelper.get_adh_url(info)
 
         # uses progressbar2
@@ -131,18 +175,22 @@ class FileHandler_adh:
             AdaptiveETA()
         ])
 
-        def report_callback(count, block_size, total_size):
-            percent = ((count * block_size) / total_size) * 100
+        def report_callback(done, total_size):
+            percent = (done / total_size) * 100
             prog.update(min(percent, 100))
 
         prog.start()
 
-        opener = urllib.request.build_opener()
-        opener.addheaders = [
-            ('User-Agent', 'Audible ADM 6.6.0.19;Windows Vista  Build 9200'),
-        ]
-        urllib.request.install_opener(opener)
-        urllib.request.urlretrieve(url, filename = target, reporthook = report_callback)
+        headers = {
+            'User-Agent': 'Audible ADM 6.6.0.19;Windows Vista  Build 9200',
+        }
+
+        # this resumes from a '.part' file, if one was left behind
+        d = Downloader(url, target, headers=headers, connections=config.download_connections, progress=report_callback)
+        if sink is not None:
+            d.stream(sink)
+        else:
+            d.run()
 
         prog.finish()
 
@@ -0,0 +1,143 @@
+import os
+import time
+import resource
+import shutil
+import threading
+
+from aax_to_ogg.args import config
+
+class Governor:
+    # keeps the work within its share of the machine... each ffmpeg gets its
+    # share of the CPU budget as threads, runs at the requested priority, and
+    # the number of encodes that run at once is lowered while the system is
+    # loaded (or under memory / CPU pressure), and raised again as it recovers
+    check_interval = 5.0
+
+    ionice_classes = {
+        'realtime':    '1',
+        'best-effort': '2',
+        'idle':        '3',
+    }
+
+    lock = threading.Lock()
+    limit = None
+    checked = 0
+
+    # the increment to pass to 'nice' (None until it's been worked out)
+    nice_increment = None
+
+    @staticmethod
+    def threads():
+        # the budget is shared between the encodes that can run at once
+        return max(1, config.cpu_budget // max(1, config.parallel))
+
+    @classmethod
+    def ffmpeg_args(cls, args):
+        # the first is an input option (decoding), the second an output option
+        threads = '%d' % ( cls.threads() )
+        return [ args[0], '-threads', threads, *args[1:-1], '-threads', threads, args[-1] ]
+
+    @classmethod
+    def command(cls, args):
+        # returns the command line to actually run
+        if os.path.basename(args[0]) == 'ffmpeg':
+            args = cls.ffmpeg_args(args)
+
+        increment = cls.get_nice_increment()
+        if increment != 0:
+            if shutil.which('nice') is None:
+                raise Exception('nice is not installed...')
+            args = [ 'nice', '-n', '%d' % ( increment ), *args ]
+
+        if config.ionice is not None:
+            if shutil.which('ionice') is None:
+                raise Exception('ionice is not installed...')
+            args = [ 'ionice', '-c', cls.ionice_classes[config.ionice], *args ]
+
+        return args
+
+    @classmethod
+    def get_nice_increment(cls):
+        # 'nice' sets the niceness before the child starts, so all of its
+        # threads get it... it's relative to our own, and can only be lowered
+        # with the privilege to do so
+        if config.nice == 0:
+            return 0
+
+        with cls.lock:
+            if cls.nice_increment is None:
+                current = os.getpriority(os.PRIO_PROCESS, 0)
+
+                if config.nice >= current or cls.can_lower_niceness(config.nice):
+                    cls.nice_increment = config.nice - current
+                else:
+                    print('WARNING: not allowed to lower the niceness to %d... running at %d' % ( config.nice, current ))
+                    cls.nice_increment = 0
+
+            return cls.nice_increment
+
+    @staticmethod
+    def can_lower_niceness(niceness):
+        # root can, and anyone else as far as RLIMIT_NICE allows (its limit is
+        # 20 - niceness)
+        if os.geteuid() == 0:
+            return True
+
+        soft, _ = resource.getrlimit(resource.RLIMIT_NICE)
+        return soft == resource.RLIM_INFINITY or 20 - soft <= niceness
+
+    @staticmethod
+    def pressure(resource):
+        # the share of time that some tasks were stalled on the resource, over
+        # the last 10 seconds (as a percentage)... None without PSI
+        try:
+            with open('/proc/pressure/%s' % ( resource ), 'r') as f:
+                for line in f:
+                    fields = line.split()
+                    if fields[0] == 'some':
+                        return float(dict(field.split('=') for field in fields[1:])['avg10'])
+        except ( OSError, ValueError, KeyError ):
+            pass
+        return None
+
+    @classmethod
+    def overloaded(cls, margin=1.0):
+        if config.max_load is not None:
+            if os.getloadavg()[0] > config.max_load * margin:
+                return True
+
+        if config.max_pressure is not None:
+            for resource in ( 'memory', 'cpu' ):
+                pressure = cls.pressure(resource)
+                if pressure is not None and pressure > config.max_pressure * margin:
+                    return True
+
+        return False
+
+    @classmethod
+    def concurrency(cls, workers):
+        # how many encodes may run right now... it steps down by one while the
+        # system is overloaded, and back up once it is comfortably below
+        if config.max_load is None and config.max_pressure is None:
+            return workers
+
+        with cls.lock:
+            if cls.limit is None:
+                cls.limit = workers
+
+            now = time.monotonic()
+            if now - cls.checked >= cls.check_interval:
+                cls.checked = now
+
+                if cls.overloaded():
+                    limit = max(1, cls.limit - 1)
+                elif not cls.overloaded(margin=0.8):
+                    limit = min(workers, cls.limit + 1)
+                else:
+                    limit = cls.limit
+
+                if limit != cls.limit and config.debug:
+                    print('    NOTE: running %d encodes at once... (was %d)' % ( limit, cls.limit ))
+                cls.limit = limit
+
+            return cls.limit
@@ -0,0 +1,86 @@
+import re
+import subprocess
+
+from aax_to_ogg.args import config
+from aax_to_ogg import process
+
+class Loudness:
+    # the EBU R128 loudness of a whole book, measured by ffmpeg's ebur128
+    # filter in one decode... each part then gets the same fixed gain, so that
+    # the book as a whole hits the target (and the parts keep their levels
+    # relative to each other)
+    filter = 'ebur128=peak=true:framelog=quiet'
+
+    # below this, it's (near enough) silence, and can't be measured
+    min_integrated = -70.0
+
+    summary_fields = {
+        'integrated': 'I',
+        'range':      'LRA',
+        'true_peak':  'Peak',
+    }
+
+    @classmethod
+    def output_args(cls):
+        # an extra output for any ffmpeg that reads the whole input... the
+        # summary is only logged at the 'info' level
+        return [
+            '-map', '0:a',
+            '-filter:a', cls.filter,
+            '-f', 'null',
+            '-',
+        ]
+
+    @classmethod
+    def parse(cls, stderr):
+        # returns { 'integrated': LUFS, 'range': LU, 'true_peak': dBFS }, or None
+        text = stderr.decode('utf-8', 'replace')
+
+        pos = text.rfind('Summary:')
+        if pos < 0:
+            return None
+
+        loudness = {}
+        for key, label in cls.summary_fields.items():
+            match = re.search('^\s*%s:\s+(?P<value>-?(inf|[0-9.]+))' % ( label ), text[pos:], re.MULTILINE)
+            if match is None:
+                return None
+            loudness[key] = float(match.group('value'))
+
+        return loudness
+
+    @classmethod
+    def measure(cls, input_filename, activation_bytes, timeout=None):
+        args = [
+            'ffmpeg',
+            '-nostats',
+            '-loglevel', 'info',
+        ]
+        if activation_bytes is not None:
+            args.extend([
+                '-activation_bytes', activation_bytes,
+            ])
+        args.extend([
+            '-i', input_filename,
+            *cls.output_args(),
+        ])
+
+        p = process.run(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=timeout)
+
+        loudness = cls.parse(p.stderr) if p.returncode == 0 else None
+        if loudness is None:
+            raise Exception('unable to measure the loudness...%s' % ( ' (timed out)' if p.timed_out else '' ))
+
+        return loudness
+
+    @classmethod
+    def gain(cls, loudness):
+        # the gain (in dB) that brings the book to the target, without pushing
+        # its true peak over the ceiling... None if there's nothing to do
+        if loudness is None or loudness['integrated'] <= cls.min_integrated:
+            return None
+
+        gain = config.loudness_target - loudness['integrated']
+        gain = min(gain, config.true_peak_max - loudness['true_peak'])
+
+        return round(gain, 2)
@@ -0,0 +1,83 @@
+import os
+import json
+import hashlib
+import threading
+
+class Manifest:
+    # records each part that has been written for a book (along with what it
+    # was written from), so that a re-run only redoes what is missing or out of
+    # date... it lives next to the book's '<book_id>.json'
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+
+        self.data = { 'parts': {} }
+        if os.path.exists(filename):
+            try:
+                with open(filename, 'r') as f:
+                    self.data = json.load(f)
+            except ValueError:
+                # a broken manifest just means that everything gets redone
+                pass
+
+        self.data.setdefault('parts', {})
+
+    def save(self):
+        # called with the lock held
+        tmp = '%s.tmp' % ( self.filename )
+        with open(tmp, 'w') as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp, self.filename)
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self.data.get(key, default)
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.save()
+
+    def is_done(self, num, params, output_filename):
+        with self.lock:
+            record = self.data['parts'].get('%d' % ( num ))
+
+        if record is None or record['status'] != 'done' or record['params'] != params:
+            return False
+
+        if not os.path.exists(output_filename):
+            return False
+
+        return os.path.getsize(output_filename) == record['size']
+
+    def mark(self, num, params, status, output_filename=None):
+        record = {
+            'status': status,
+            'params': params,
+            'filename': None,
+            'size': None,
+            'sha256': None,
+        }
+
+        if output_filename is not None:
+            h = hashlib.sha256()
+            with open(output_filename, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(block)
+
+            record['filename'] = os.path.basename(output_filename)
+            record['size'] = os.path.getsize(output_filename)
+            record['sha256'] = h.hexdigest()
+
+        with self.lock:
+            self.data['parts']['%d' % ( num )] = record
+            self.save()
+
+    def retagged(self, num, output_filename):
+        # only the part's headers have changed... rather than read all of it
+        # again, the hash is dropped (the size is what is checked)
+        with self.lock:
+            record = self.data['parts']['%d' % ( num )]
+            record['size'] = os.path.getsize(output_filename)
+            record['sha256'] = None
+            self.save()
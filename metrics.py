@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import threading
+import contextlib
+
+from aax_to_ogg.args import config
+
+class Measurement:
+    # the cost of one stage for one book... the children's usage (see
+    # process.run) is added in as they finish
+    def __init__(self, stage, group=None, audio_seconds=None, **extra):
+        self.stage = stage
+        self.group = group
+        self.audio_seconds = audio_seconds
+        self.extra = extra
+
+        self.started = time.monotonic()
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.read_bytes = 0
+        self.write_bytes = 0
+        self.max_rss = 0
+        self.stderr = None
+
+    def add(self, usage, stderr=None):
+        self.cpu += usage.cpu
+        self.read_bytes += usage.read_bytes
+        self.write_bytes += usage.write_bytes
+        self.max_rss = max(self.max_rss, usage.max_rss)
+
+        if stderr:
+            self.stderr = stderr[-2000:].decode('utf-8', 'replace')
+
+    def event(self, status):
+        event = {
+            'time': time.time(),
+            'stage': self.stage,
+            'group': self.group,
+            'status': status,
+            'wall': round(self.wall, 6),
+            'cpu': round(self.cpu, 6),
+            'read_bytes': self.read_bytes,
+            'write_bytes': self.write_bytes,
+            'max_rss': self.max_rss,
+            'audio_seconds': None if self.audio_seconds is None else round(self.audio_seconds, 6),
+            'realtime': None,
+            **self.extra,
+        }
+
+        if status == 'ok' and self.audio_seconds and self.wall > 0:
+            event['realtime'] = round(self.audio_seconds / self.wall, 3)
+        if self.stderr is not None:
+            event['stderr'] = self.stderr
+
+        return event
+
+class Metrics:
+    # every stage reports here... each one is appended to a JSON-lines log
+    # (--metrics-log), and the running totals are written out in Prometheus'
+    # text format (--metrics-textfile) for node_exporter's textfile collector
+    prefix = 'aax_to_ogg_stage'
+
+    lock = threading.Lock()
+    local = threading.local()
+    totals = {}
+
+    @classmethod
+    def active(cls):
+        # the measurements that are open on this thread, outermost first
+        if not hasattr(cls.local, 'stack'):
+            cls.local.stack = []
+        return cls.local.stack
+
+    @classmethod
+    @contextlib.contextmanager
+    def measure(cls, stage, group=None, audio_seconds=None, **extra):
+        m = Measurement(stage, group, audio_seconds, **extra)
+        cpu_started = time.thread_time()
+
+        cls.active().append(m)
+        try:
+            yield m
+        except BaseException:
+            status = 'failed'
+            raise
+        else:
+            status = 'ok'
+        finally:
+            cls.active().remove(m)
+            m.cpu += time.thread_time() - cpu_started
+            cls.record(m, status)
+
+    @classmethod
+    def add_usage(cls, usage, stderr=None):
+        # a child has finished... it counts towards everything that is open
+        for m in cls.active():
+            m.add(usage, stderr)
+
+    @classmethod
+    def record(cls, m, status='ok'):
+        m.wall = time.monotonic() - m.started
+        event = m.event(status)
+
+        with cls.lock:
+            total = cls.totals.setdefault(m.stage, {
+                'runs': {},
+                'seconds': 0.0,
+                'cpu_seconds': 0.0,
+                'read_bytes': 0,
+                'write_bytes': 0,
+                'audio_seconds': 0.0,
+            })
+            total['runs'][status] = total['runs'].get(status, 0) + 1
+            total['seconds'] += m.wall
+            total['cpu_seconds'] += m.cpu
+            total['read_bytes'] += m.read_bytes
+            total['write_bytes'] += m.write_bytes
+            total['audio_seconds'] += m.audio_seconds or 0
+
+            if config.metrics_log is not None:
+                with open(config.metrics_log, 'a') as f:
+                    f.write(json.dumps(event) + '\n')
+
+            if config.metrics_textfile is not None:
+                cls.write_textfile()
+
+    @classmethod
+    def write_textfile(cls):
+        # called with the lock held... the collector may read it at any time,
+        # so it's replaced in one go
+        metrics = [
+            ( 'runs_total',          'counter', 'The number of times that each stage has run.' ),
+            ( 'seconds_total',       'counter', 'The wall time spent in each stage.' ),
+            ( 'cpu_seconds_total',   'counter', 'The CPU time used by each stage, including its ffmpeg processes.' ),
+            ( 'read_bytes_total',    'counter', 'The bytes read from storage by each stage\'s processes.' ),
+            ( 'write_bytes_total',   'counter', 'The bytes written to storage by each stage\'s processes.' ),
+            ( 'audio_seconds_total', 'counter', 'The audio processed by each stage (divide by seconds_total for the realtime factor).' ),
+        ]
+
+        lines = []
+        for name, kind, help_text in metrics:
+            lines.append('# HELP %s_%s %s' % ( cls.prefix, name, help_text ))
+            lines.append('# TYPE %s_%s %s' % ( cls.prefix, name, kind ))
+
+            for stage, total in sorted(cls.totals.items()):
+                if name == 'runs_total':
+                    for status, count in sorted(total['runs'].items()):
+                        lines.append('%s_%s{stage="%s",status="%s"} %d' % ( cls.prefix, name, stage, status, count ))
+                else:
+                    lines.append('%s_%s{stage="%s"} %s' % ( cls.prefix, name, stage, repr(total[name[:-len('_total')]]) ))
+
+        tmp = '%s.tmp' % ( config.metrics_textfile )
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp, config.metrics_textfile)
@@ -0,0 +1,472 @@
+import mmap
+import struct
+
+# 'ilst' atoms, and the names that ffprobe gives them
+METADATA_ATOMS = {
+    b'\xa9nam': 'title',
+    b'\xa9ART': 'artist',
+    b'aART':   'album_artist',
+    b'\xa9alb': 'album',
+    b'\xa9day': 'date',
+    b'\xa9gen': 'genre',
+    b'\xa9cmt': 'comment',
+    b'\xa9wrt': 'composer',
+    b'\xa9too': 'encoder',
+    b'cprt':   'copyright',
+    b'desc':   'description',
+    b'ldes':   'synopsis',
+}
+
+# MPEG-4 object type indications that we care about
+OBJECT_TYPES = {
+    0x40: 'aac',
+    0x66: 'aac',
+    0x67: 'aac',
+    0x68: 'aac',
+    0x69: 'mp3',
+    0x6b: 'mp3',
+}
+
+HANDLER_TYPES = {
+    b'soun': 'Audio',
+    b'vide': 'Video',
+    b'text': 'Data',
+    b'sbtl': 'Subtitle',
+}
+
+class Mp4Error(Exception):
+    pass
+
+class Mp4File:
+    def __init__(self, filename):
+        self.filename = filename
+
+        with open(filename, 'rb') as f:
+            try:
+                self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # can't map an empty file
+                raise Mp4Error('empty file... [%s]' % ( filename ))
+
+        self.size = len(self.buf)
+
+        ftyp = self.find(b'ftyp')
+        if ftyp is None:
+            self.close()
+            raise Mp4Error('not an MP4 file... [%s]' % ( filename ))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.buf is not None:
+            self.buf.close()
+            self.buf = None
+
+    def boxes(self, start=0, end=None):
+        # yields ( type, payload_start, payload_end ) for each box in the range
+        if end is None:
+            end = self.size
+
+        pos = start
+        while pos + 8 <= end:
+            size, box_type = struct.unpack_from('>I4s', self.buf, pos)
+            header = 8
+
+            if size == 1:
+                if pos + 16 > end:
+                    raise Mp4Error('truncated box header...')
+                size, = struct.unpack_from('>Q', self.buf, pos + 8)
+                header = 16
+            elif size == 0:
+                # the box runs to the end of its parent
+                size = end - pos
+
+            if size < header or pos + size > end:
+                raise Mp4Error('truncated box... [%s]' % ( box_type.decode('latin-1') ))
+
+            yield box_type, pos + header, pos + size
+            pos += size
+
+    def find(self, *path, start=0, end=None):
+        # returns ( payload_start, payload_end ) of the first box at the path
+        box = self.find_all(*path, start=start, end=end)
+        return next(box, None)
+
+    def find_all(self, *path, start=0, end=None):
+        name, rest = path[0], path[1:]
+
+        for box_type, b_start, b_end in self.boxes(start, end):
+            if box_type != name:
+                continue
+
+            if len(rest) == 0:
+                yield b_start, b_end
+            else:
+                yield from self.find_all(*rest, start=b_start, end=b_end)
+
+    def sample_entries(self, stbl):
+        # yields ( format, payload_start, payload_end, children_start ) for each
+        # of the sample descriptions in the given 'stbl' box
+        stsd = self.find(b'stsd', start=stbl[0], end=stbl[1])
+        if stsd is None:
+            return
+
+        # skip version / flags, and the entry count
+        for fmt, e_start, e_end in self.boxes(stsd[0] + 8, stsd[1]):
+            # a sound sample description is 28 bytes, plus more for the
+            # QuickTime v1 / v2 layouts... child boxes follow
+            version, = struct.unpack_from('>H', self.buf, e_start + 8)
+            children = e_start + 28 + { 1: 16, 2: 36 }.get(version, 0)
+
+            yield fmt, e_start, e_end, min(children, e_end)
+
+    def adrm_checksum(self):
+        # returns the Audible DRM checksum, or None if the file isn't encrypted
+        for mdia in self.find_all(b'moov', b'trak', b'mdia'):
+            # only the audio sample descriptions have this layout
+            hdlr = self.find(b'hdlr', start=mdia[0], end=mdia[1])
+            if hdlr is None or self.buf[hdlr[0] + 8:hdlr[0] + 12] != b'soun':
+                continue
+
+            stbl = self.find(b'minf', b'stbl', start=mdia[0], end=mdia[1])
+            if stbl is None:
+                continue
+
+            for fmt, e_start, e_end, children in self.sample_entries(stbl):
+                adrm = self.find(b'adrm', start=children, end=e_end)
+                if adrm is None:
+                    continue
+
+                # the checksum lives after a header and the 56 byte DRM blob
+                if adrm[1] - adrm[0] < 88:
+                    raise Mp4Error('truncated adrm box...')
+
+                return bytes(self.buf[adrm[0] + 68:adrm[0] + 88])
+
+        return None
+
+    # ---
+
+    def u8(self, pos):
+        return self.buf[pos]
+
+    def u16(self, pos):
+        return struct.unpack_from('>H', self.buf, pos)[0]
+
+    def u32(self, pos):
+        return struct.unpack_from('>I', self.buf, pos)[0]
+
+    def u64(self, pos):
+        return struct.unpack_from('>Q', self.buf, pos)[0]
+
+    def read_ftyp(self):
+        start, end = self.find(b'ftyp')
+        return {
+            'major_brand': self.buf[start:start + 4].decode('latin-1'),
+            'minor_version': '%d' % ( self.u32(start + 4) ),
+            'compatible_brands': self.buf[start + 8:end].decode('latin-1'),
+        }
+
+    def read_timescale(self, box):
+        # 'mvhd' and 'mdhd' share a layout... returns ( timescale, duration, end )
+        start, _ = box
+        if self.u8(start) == 1:
+            return self.u32(start + 20), self.u64(start + 24), start + 32
+        return self.u32(start + 12), self.u32(start + 16), start + 20
+
+    def read_table(self, stbl, name, fmt):
+        # reads the entries from a sample table (e.g: 'stts', 'stsc', 'stco')
+        box = self.find(name, start=stbl[0], end=stbl[1])
+        if box is None:
+            return []
+
+        count = self.u32(box[0] + 4)
+        size = struct.calcsize(fmt)
+        if box[0] + 8 + count * size > box[1]:
+            raise Mp4Error('truncated sample table... [%s]' % ( name.decode('latin-1') ))
+
+        return list(struct.iter_unpack(fmt, self.buf[box[0] + 8:box[0] + 8 + count * size]))
+
+    def read_sample_sizes(self, stbl):
+        box = self.find(b'stsz', start=stbl[0], end=stbl[1])
+        if box is None:
+            return []
+
+        sample_size, count = struct.unpack_from('>II', self.buf, box[0] + 4)
+        if sample_size != 0:
+            return [ sample_size ] * count
+
+        if box[0] + 12 + count * 4 > box[1]:
+            raise Mp4Error('truncated sample table... [stsz]')
+        return list(struct.unpack_from('>%dI' % ( count ), self.buf, box[0] + 12))
+
+    def read_samples(self, stbl):
+        # yields ( offset, size, time, duration ) for each sample in the track
+        sizes = self.read_sample_sizes(stbl)
+        chunks = [ _[0] for _ in self.read_table(stbl, b'stco', '>I') ]
+        if len(chunks) == 0:
+            chunks = [ _[0] for _ in self.read_table(stbl, b'co64', '>Q') ]
+        stsc = self.read_table(stbl, b'stsc', '>III')
+
+        durations = []
+        for count, delta in self.read_table(stbl, b'stts', '>II'):
+            durations.extend([ delta ] * count)
+
+        sample = 0
+        time = 0
+        for i, ( first_chunk, per_chunk, _ ) in enumerate(stsc):
+            if i + 1 < len(stsc):
+                last_chunk = stsc[i + 1][0]
+            else:
+                last_chunk = len(chunks) + 1
+
+            for chunk in range(first_chunk, last_chunk):
+                offset = chunks[chunk - 1]
+                for _ in range(per_chunk):
+                    if sample >= len(sizes):
+                        return
+
+                    duration = durations[sample] if sample < len(durations) else 0
+                    yield offset, sizes[sample], time, duration
+
+                    offset += sizes[sample]
+                    time += duration
+                    sample += 1
+
+    def read_esds(self, start, end):
+        # returns ( object_type, avg_bitrate ) from an 'esds' box
+        esds = self.find(b'esds', start=start, end=end)
+        if esds is None:
+            return None, 0
+
+        def descriptor(pos):
+            tag = self.u8(pos)
+            pos += 1
+            length = 0
+            for _ in range(4):
+                b = self.u8(pos)
+                pos += 1
+                length = ( length << 7 ) | ( b & 0x7f )
+                if not b & 0x80:
+                    break
+            return tag, pos, length
+
+        try:
+            tag, pos, _ = descriptor(esds[0] + 4)
+            if tag != 0x03:
+                return None, 0
+
+            flags = self.u8(pos + 2)
+            pos += 3
+            if flags & 0x80:
+                pos += 2
+            if flags & 0x40:
+                pos += 1 + self.u8(pos)
+            if flags & 0x20:
+                pos += 2
+
+            tag, pos, _ = descriptor(pos)
+            if tag != 0x04:
+                return None, 0
+
+            return self.u8(pos), self.u32(pos + 9)
+        except IndexError:
+            raise Mp4Error('truncated esds box...')
+
+    def read_ilst(self):
+        meta = self.find(b'moov', b'udta', b'meta')
+        if meta is None:
+            meta = self.find(b'moov', b'meta')
+        if meta is None:
+            return {}
+
+        # the ISO 'meta' box is a full box... the QuickTime one is not
+        start, end = meta
+        if self.buf[start + 4:start + 8] != b'hdlr':
+            start += 4
+
+        ilst = self.find(b'ilst', start=start, end=end)
+        if ilst is None:
+            return {}
+
+        items = {}
+        for atom, a_start, a_end in self.boxes(*ilst):
+            data = self.find(b'data', start=a_start, end=a_end)
+            if data is None:
+                continue
+
+            data_type = self.u32(data[0]) & 0xffffff
+            value = self.buf[data[0] + 8:data[1]]
+            items[atom] = ( data_type, value )
+
+        return items
+
+    def read_tracks(self):
+        tracks = []
+
+        for trak in self.find_all(b'moov', b'trak'):
+            track = {
+                'track_id': None,
+                'handler': None,
+                'language': 'und',
+                'timescale': 1,
+                'duration': 0,
+                'format': None,
+                'chapter_refs': [],
+                'object_type': None,
+                'avg_bitrate': 0,
+                'stbl': None,
+            }
+
+            tkhd = self.find(b'tkhd', start=trak[0], end=trak[1])
+            if tkhd is not None:
+                track['track_id'] = self.u32(tkhd[0] + ( 20 if self.u8(tkhd[0]) == 1 else 12 ))
+
+            chap = self.find(b'tref', b'chap', start=trak[0], end=trak[1])
+            if chap is not None:
+                track['chapter_refs'] = list(struct.unpack_from('>%dI' % ( ( chap[1] - chap[0] ) // 4 ), self.buf, chap[0]))
+
+            mdia = self.find(b'mdia', start=trak[0], end=trak[1])
+            if mdia is None:
+                continue
+
+            mdhd = self.find(b'mdhd', start=mdia[0], end=mdia[1])
+            if mdhd is not None:
+                track['timescale'], track['duration'], pos = self.read_timescale(mdhd)
+                lang = self.u16(pos)
+                if lang not in ( 0, 0x7fff ):
+                    track['language'] = ''.join(chr(( ( lang >> shift ) & 0x1f ) + 0x60) for shift in ( 10, 5, 0 ))
+
+            hdlr = self.find(b'hdlr', start=mdia[0], end=mdia[1])
+            if hdlr is not None:
+                track['handler'] = bytes(self.buf[hdlr[0] + 8:hdlr[0] + 12])
+
+            track['stbl'] = self.find(b'minf', b'stbl', start=mdia[0], end=mdia[1])
+            if track['stbl'] is not None:
+                for fmt, e_start, e_end, children in self.sample_entries(track['stbl']):
+                    track['format'] = fmt.decode('latin-1')
+                    if track['handler'] == b'soun':
+                        track['channels'] = self.u16(e_start + 16)
+                        track['sample_rate'] = self.u32(e_start + 24) >> 16
+                        track['object_type'], track['avg_bitrate'] = self.read_esds(children, e_end)
+                    break
+
+            tracks.append(track)
+
+        return tracks
+
+    def read_chapters(self, tracks, duration):
+        # prefer the QuickTime text track, as that's what ffmpeg does
+        refs = [ ref for track in tracks for ref in track['chapter_refs'] ]
+
+        for track in tracks:
+            if track['track_id'] not in refs or track['stbl'] is None:
+                continue
+
+            chapters = []
+            for offset, size, time, sample_duration in self.read_samples(track['stbl']):
+                if size < 2 or offset + size > self.size:
+                    continue
+
+                length = min(self.u16(offset), size - 2)
+                raw = bytes(self.buf[offset + 2:offset + 2 + length])
+                if raw[:2] in ( b'\xfe\xff', b'\xff\xfe' ):
+                    title = raw.decode('utf-16', errors='replace')
+                else:
+                    title = raw.decode('utf-8', errors='replace')
+
+                chapters.append({
+                    't_start': time / track['timescale'],
+                    't_end': min(( time + sample_duration ) / track['timescale'], duration),
+                    'title': title,
+                })
+
+            if len(chapters) > 0:
+                return chapters
+
+        # fall back to the Nero chapter list
+        chpl = self.find(b'moov', b'udta', b'chpl')
+        if chpl is None:
+            return []
+
+        pos = chpl[0] + ( 8 if self.u8(chpl[0]) == 1 else 4 )
+        count = self.u8(pos)
+        pos += 1
+
+        chapters = []
+        for _ in range(count):
+            if pos + 9 > chpl[1]:
+                raise Mp4Error('truncated chpl box...')
+            t_start = self.u64(pos) / 10000000
+            length = self.u8(pos + 8)
+            title = bytes(self.buf[pos + 9:pos + 9 + length]).decode('utf-8', errors='replace')
+            pos += 9 + length
+
+            if len(chapters) > 0:
+                chapters[-1]['t_end'] = t_start
+            chapters.append({ 't_start': t_start, 't_end': duration, 'title': title })
+
+        return chapters
+
+    def probe(self):
+        # returns everything that we'd otherwise have to get from ffprobe
+        mvhd = self.find(b'moov', b'mvhd')
+        if mvhd is None:
+            raise Mp4Error('no movie header... [%s]' % ( self.filename ))
+
+        timescale, duration, _ = self.read_timescale(mvhd)
+        if timescale == 0:
+            raise Mp4Error('invalid movie timescale...')
+        duration = duration / timescale
+
+        metadata = self.read_ftyp()
+        for atom, ( data_type, value ) in self.read_ilst().items():
+            if atom not in METADATA_ATOMS:
+                continue
+            if data_type == 1:
+                metadata[METADATA_ATOMS[atom]] = value.decode('utf-8', errors='replace')
+            elif data_type == 21:
+                metadata[METADATA_ATOMS[atom]] = '%d' % ( int.from_bytes(value, 'big', signed=True) )
+
+        tracks = self.read_tracks()
+        chapters = self.read_chapters(tracks, duration)
+
+        streams = []
+        for track in tracks:
+            stream = {
+                'type': HANDLER_TYPES.get(track['handler'], 'Data'),
+                'language': track['language'],
+                'format': track['format'],
+            }
+
+            if track['handler'] == b'soun':
+                codec = OBJECT_TYPES.get(track['object_type'])
+                if codec is None and track['format'] == 'aavd':
+                    codec = 'aac'
+                elif codec is None and track['format'] in ( '.mp3', 'mp3 ' ):
+                    codec = 'mp3'
+
+                bitrate = track['avg_bitrate']
+                if bitrate == 0 and track['duration'] > 0 and track['stbl'] is not None:
+                    bitrate = sum(self.read_sample_sizes(track['stbl'])) * 8 * track['timescale'] / track['duration']
+
+                stream.update({
+                    'codec': codec,
+                    'sample_rate': track.get('sample_rate', 0),
+                    'channels': track.get('channels', 0),
+                    'bitrate': int(bitrate / 1000),
+                })
+
+            streams.append(stream)
+
+        return {
+            'duration': duration,
+            'bitrate': int(self.size * 8 / duration / 1000) if duration > 0 else 0,
+            'metadata': metadata,
+            'chapters': chapters,
+            'streams': streams,
+        }
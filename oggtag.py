@@ -0,0 +1,335 @@
+import os
+import shutil
+import struct
+
+# the Ogg page header, up to (and including) the number of segments
+PAGE_HEADER = struct.Struct('<4sBBqIIIB')
+
+# page header flags
+CONTINUED = 0x01
+BOS = 0x02
+EOS = 0x04
+
+# the first header packet's magic -> ( codec, the comment packet's magic, the
+# number of header packets )
+CODECS = {
+    b'\x01vorbis': ( 'vorbis', b'\x03vorbis', 3 ),
+    b'OpusHead':   ( 'opus',   b'OpusTags',   2 ),
+}
+
+def _crc_table():
+    # CRC-32, polynomial 0x04c11db7, not reflected (unlike zlib's)
+    table = []
+    for i in range(256):
+        r = i << 24
+        for _ in range(8):
+            r = ( ( r << 1 ) ^ 0x04c11db7 ) if r & 0x80000000 else ( r << 1 )
+        table.append(r & 0xffffffff)
+    return tuple(table)
+
+CRC_TABLE = _crc_table()
+
+def ogg_crc(data, crc=0):
+    for b in data:
+        crc = ( ( crc << 8 ) & 0xffffffff ) ^ CRC_TABLE[( crc >> 24 ) ^ b]
+    return crc
+
+def _mulmod(a, b):
+    # multiplies two polynomials over GF(2), modulo the CRC polynomial
+    r = 0
+    while b:
+        if b & 1:
+            r ^= a
+        b >>= 1
+        a <<= 1
+        if a & 0x100000000:
+            a ^= 0x104c11db7
+    return r
+
+def _shift(crc, n):
+    # the CRC of a message with n zero bytes appended... i.e: crc * x^(8n)
+    power = 0x100        # x^8
+    while n:
+        if n & 1:
+            crc = _mulmod(crc, power)
+        n >>= 1
+        power = _mulmod(power, power)
+    return crc
+
+class OggError(Exception):
+    pass
+
+class OggPage:
+    def __init__(self, header_type, granule, serial, seq, lacing, data):
+        self.header_type = header_type
+        self.granule = granule
+        self.serial = serial
+        self.seq = seq
+        self.lacing = lacing
+        self.data = data
+
+    @classmethod
+    def read(cls, f):
+        # returns the next page, or None at the end of the file
+        header = f.read(PAGE_HEADER.size)
+        if len(header) == 0:
+            return None
+        if len(header) < PAGE_HEADER.size:
+            raise OggError('truncated page header...')
+
+        capture, version, header_type, granule, serial, seq, crc, segments = PAGE_HEADER.unpack(header)
+        if capture != b'OggS' or version != 0:
+            raise OggError('not an Ogg page...')
+
+        lacing = f.read(segments)
+        data = f.read(sum(lacing))
+        if len(lacing) < segments or len(data) < sum(lacing):
+            raise OggError('truncated page...')
+
+        return cls(header_type, granule, serial, seq, list(lacing), data)
+
+    def __bytes__(self):
+        header = PAGE_HEADER.pack(b'OggS', 0, self.header_type, self.granule, self.serial, self.seq, 0, len(self.lacing))
+        page = bytearray(header + bytes(self.lacing) + self.data)
+        struct.pack_into('<I', page, 22, ogg_crc(page))
+        return bytes(page)
+
+    @staticmethod
+    def renumber(page, delta):
+        # returns the (raw) page with its sequence number moved on by delta...
+        # the CRC is linear, so it can be patched without reading the page
+        # through: only the sequence number's bytes have changed
+        seq, crc = struct.unpack_from('<II', page, 18)
+        new_seq = ( seq + delta ) & 0xffffffff
+
+        diff = struct.pack('<I', seq ^ new_seq)
+        crc ^= _shift(ogg_crc(diff), len(page) - 22)
+
+        page = bytearray(page)
+        struct.pack_into('<II', page, 18, new_seq, crc)
+        return bytes(page)
+
+def lace(packet):
+    return [ 255 ] * ( len(packet) // 255 ) + [ len(packet) % 255 ]
+
+class OggFile:
+    # reads and writes the comments of an Ogg Vorbis / Opus file, without
+    # touching the audio... if the new comment packet fits in the old one (it
+    # is padded when it is written), the header pages are rewritten in place,
+    # otherwise the headers are rebuilt and the audio pages are copied across
+    # as they are (renumbered, if the headers now take more or fewer pages)
+    padding = 1024
+
+    def __init__(self, filename):
+        self.filename = filename
+
+        with open(filename, 'rb') as f:
+            self.read_headers(f)
+
+        self.vendor, self.comments, self.trailer = self.parse_comments(self.packets[1])
+
+    def read_headers(self, f):
+        self.pages = []
+        self.packets = []
+
+        packet = b''
+        count = None
+        while count is None or len(self.packets) < count:
+            page = OggPage.read(f)
+            if page is None:
+                raise OggError('the headers are incomplete... [%s]' % ( self.filename ))
+            if len(self.pages) > 0 and page.serial != self.pages[0].serial:
+                raise OggError('only a single logical stream is supported... [%s]' % ( self.filename ))
+
+            self.pages.append(page)
+
+            pos = 0
+            for n in page.lacing:
+                packet += page.data[pos:pos + n]
+                pos += n
+                if n < 255:
+                    self.packets.append(packet)
+                    packet = b''
+
+            if count is None and len(self.packets) > 0:
+                magic = self.packets[0][:8] if self.packets[0][:8] == b'OpusHead' else self.packets[0][:7]
+                if magic not in CODECS:
+                    raise OggError('not Vorbis or Opus... [%s]' % ( self.filename ))
+                self.codec, self.comment_magic, count = CODECS[magic]
+
+        # the audio always starts on a new page
+        if len(self.packets) != count or len(packet) > 0:
+            raise OggError('the headers share a page with the audio... [%s]' % ( self.filename ))
+        if not self.packets[1].startswith(self.comment_magic):
+            raise OggError('no comment header... [%s]' % ( self.filename ))
+
+        self.header_size = f.tell()
+
+    def parse_comments(self, packet):
+        # returns ( vendor, [ ( key, value ), ... ], what follows them )
+        try:
+            pos = len(self.comment_magic)
+
+            length, = struct.unpack_from('<I', packet, pos)
+            vendor = packet[pos + 4:pos + 4 + length].decode('utf-8', 'replace')
+            pos += 4 + length
+
+            count, = struct.unpack_from('<I', packet, pos)
+            pos += 4
+
+            comments = []
+            for _ in range(count):
+                length, = struct.unpack_from('<I', packet, pos)
+                comment = packet[pos + 4:pos + 4 + length].decode('utf-8', 'replace')
+                pos += 4 + length
+
+                key, _, value = comment.partition('=')
+                comments.append(( key, value ))
+        except struct.error:
+            raise OggError('broken comment header... [%s]' % ( self.filename ))
+
+        # Vorbis ends with the framing bit (anything after is padding)... Opus
+        # can have binary data after, which is kept if its first bit is set
+        trailer = packet[pos:]
+        if self.codec == 'vorbis':
+            trailer = b'\x01'
+        elif len(trailer) > 0 and trailer[0] & 1 == 0:
+            trailer = b''
+
+        return vendor, comments, trailer
+
+    def build_comments(self, size=0):
+        # returns the comment packet, padded out to size
+        vendor = self.vendor.encode('utf-8')
+
+        packet = bytearray(self.comment_magic)
+        packet += struct.pack('<I', len(vendor)) + vendor
+        packet += struct.pack('<I', len(self.comments))
+        for key, value in self.comments:
+            comment = ( '%s=%s' % ( key, value ) ).encode('utf-8')
+            packet += struct.pack('<I', len(comment)) + comment
+        packet += self.trailer
+
+        # an Opus trailer that is kept has to come last... so there's no
+        # room to pad it
+        if self.codec == 'opus' and len(self.trailer) > 0:
+            return bytes(packet)
+
+        return bytes(packet) + b'\x00' * max(0, size - len(packet))
+
+    def get(self, key):
+        # keys are case insensitive
+        return [ v for k, v in self.comments if k.upper() == key.upper() ]
+
+    def update(self, tags):
+        # replaces the comments with the given keys (a value of None removes
+        # them), and returns whether anything changed
+        comments = list(self.comments)
+
+        for key, value in tags.items():
+            values = [] if value is None else [ value ]
+            if self.get(key) == values:
+                continue
+
+            comments = [ ( k, v ) for k, v in comments if k.upper() != key.upper() ]
+            comments.extend(( key, v ) for v in values)
+
+        changed = comments != self.comments
+        self.comments = comments
+        return changed
+
+    def save(self):
+        # returns True if the file was rewritten in place
+        old = self.packets[1]
+        new = self.build_comments(len(old))
+
+        if len(new) == len(old):
+            self.save_in_place(new)
+            return True
+
+        self.save_rebuilt(self.build_comments(len(new) + self.padding))
+        return False
+
+    def save_in_place(self, comments):
+        # the packets are the same size, so the pages keep their layout... the
+        # header pages hold nothing but the header packets, end to end
+        data = b''.join([ self.packets[0], comments, *self.packets[2:] ])
+
+        pages = []
+        pos = 0
+        for page in self.pages:
+            pages.append(OggPage(page.header_type, page.granule, page.serial, page.seq, page.lacing, data[pos:pos + len(page.data)]))
+            pos += len(page.data)
+
+        with open(self.filename, 'r+b') as f:
+            for page in pages:
+                f.write(bytes(page))
+
+        self.packets[1] = comments
+        self.pages = pages
+
+    def paginate(self, packets):
+        # the first header gets a page of its own, the others are packed in to
+        # as few pages as they'll fit, and the last of them ends its page
+        first = self.pages[0]
+        pages = [ OggPage(BOS, 0, first.serial, 0, lace(packets[0]), packets[0]) ]
+
+        segments = []
+        for packet in packets[1:]:
+            pos = 0
+            for n in lace(packet):
+                segments.append(( n, packet[pos:pos + n] ))
+                pos += n
+
+        continued = False
+        for i in range(0, len(segments), 255):
+            chunk = segments[i:i + 255]
+            lacing = [ n for n, _ in chunk ]
+
+            # a page on which no packet ends has no granule position
+            granule = 0 if any(n < 255 for n in lacing) else -1
+
+            pages.append(OggPage(CONTINUED if continued else 0, granule, first.serial, len(pages), lacing, b''.join(data for _, data in chunk)))
+            continued = lacing[-1] == 255
+
+        return pages
+
+    def save_rebuilt(self, comments):
+        packets = [ self.packets[0], comments, *self.packets[2:] ]
+        pages = self.paginate(packets)
+        delta = len(pages) - len(self.pages)
+
+        tmp = '%s.tmp' % ( self.filename )
+        with open(self.filename, 'rb') as f_in, open(tmp, 'wb') as f_out:
+            for page in pages:
+                f_out.write(bytes(page))
+
+            f_in.seek(self.header_size)
+            if delta == 0:
+                shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+            else:
+                self.copy_renumbered(f_in, f_out, delta)
+
+        shutil.copymode(self.filename, tmp)
+        os.replace(tmp, self.filename)
+
+        self.packets = packets
+        self.pages = pages
+        self.header_size = sum(len(bytes(page)) for page in pages)
+
+    def copy_renumbered(self, f_in, f_out, delta):
+        serial = self.pages[0].serial
+
+        while True:
+            header = f_in.read(PAGE_HEADER.size)
+            if len(header) == 0:
+                break
+            if len(header) < PAGE_HEADER.size or header[:4] != b'OggS':
+                raise OggError('broken page... [%s]' % ( self.filename ))
+
+            lacing = f_in.read(header[26])
+            page = header + lacing + f_in.read(sum(lacing))
+
+            if struct.unpack_from('<I', page, 14)[0] == serial:
+                page = OggPage.renumber(page, delta)
+            f_out.write(page)
@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import threading
+import subprocess
+
+from aax_to_ogg.util import console_lock
+from aax_to_ogg.metrics import Metrics
+from aax_to_ogg.governor import Governor
+
+class Usage:
+    # what a child process used, from its rusage... the block counts only
+    # include I/O that actually reached storage (i.e: not the page cache)
+    def __init__(self, wall, rusage):
+        self.wall = wall
+        self.cpu = rusage.ru_utime + rusage.ru_stime
+        self.read_bytes = rusage.ru_inblock * 512
+        self.write_bytes = rusage.ru_oublock * 512
+        self.max_rss = rusage.ru_maxrss * 1024
+
+def wait(p, started):
+    # reaps the child ourselves, so that we can have its rusage... once the
+    # returncode is set, Popen won't try to wait for it again
+    _, status, rusage = os.wait4(p.pid, 0)
+
+    p.returncode = os.waitstatus_to_exitcode(status)
+    p.usage = Usage(time.monotonic() - started, rusage)
+
+    return p.returncode
+
+def popen(args, **kwargs):
+    # starts the child within the limits set by the Governor
+    return subprocess.Popen(Governor.command(args), **kwargs)
+
+def run(args, stderr=None, timeout=None, **kwargs):
+    # like subprocess.run(), but the child's usage is added to the open
+    # measurements (see Metrics.measure)... stderr is always captured, and
+    # unless the caller asked for it (or discarded it), it is passed on
+    #
+    # if it runs for longer than timeout, the child is killed... rather than
+    # raising, the result has 'timed_out' set (and a non-zero returncode)
+    started = time.monotonic()
+
+    p = popen(args, stderr=subprocess.PIPE, **kwargs)
+
+    lock = threading.Lock()
+    state = { 'exited': False, 'timed_out': False }
+
+    def kill():
+        with lock:
+            if not state['exited']:
+                state['timed_out'] = True
+                p.kill()
+
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, kill)
+        timer.daemon = True
+        timer.start()
+
+    output = {}
+    def read(name, f):
+        output[name] = f.read()
+        f.close()
+
+    readers = [
+        threading.Thread(target=read, args=( name, getattr(p, name) ), daemon=True)
+        for name in ( 'stdout', 'stderr' )
+        if getattr(p, name) is not None
+    ]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+
+    if timer is not None:
+        # wait for it to exit without reaping it, so that the timer can't kill
+        # some other process that has been given the same pid
+        os.waitid(os.P_PID, p.pid, os.WEXITED | os.WNOWAIT)
+        with lock:
+            state['exited'] = True
+        timer.cancel()
+
+    wait(p, started)
+    Metrics.add_usage(p.usage, output['stderr'])
+
+    if stderr is None and len(output['stderr']) > 0:
+        with console_lock:
+            sys.stderr.buffer.write(output['stderr'])
+            sys.stderr.flush()
+
+    result = subprocess.CompletedProcess(args, p.returncode, output.get('stdout'), output['stderr'] if stderr == subprocess.PIPE else None)
+    result.usage = p.usage
+    result.timed_out = state['timed_out']
+
+    return result
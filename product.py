@@ -1,18 +1,30 @@
 from pprint import pprint
 
 import re
-import urllib.parse, urllib.request
+import urllib.parse
 import json
+import threading
 from sys import stderr
 from lxml import html
 from collections import OrderedDict
 
 from aax_to_ogg.args import config
+from aax_to_ogg.fetch import Fetcher
 
 class ProductHelper:
     xpath_search_item_all   = "//li[contains(concat(' ',normalize-space(@class),' '),' productListItem ')]"
     xpath_product_info_json = "//div[@id='bottom-0']/script[2]/text()"
 
+    fetcher = None
+    fetcher_lock = threading.Lock()
+
+    @classmethod
+    def get_fetcher(cls):
+        with cls.fetcher_lock:
+            if cls.fetcher is None:
+                cls.fetcher = Fetcher()
+            return cls.fetcher
+
     @staticmethod
     def get_search_url(domain, search_keywords):
         prefix = 'https://' + domain + '/search?'
@@ -48,8 +60,11 @@ class ProductHelper:
     def search_for_book_id(cls, domain, search_term):
         # search for the book ID
         url = cls.get_search_url(domain, search_term)
-        with urllib.request.urlopen(url) as search_req:
-            et = html.fromstring(search_req.read())
+        return cls.get_fetcher().get(url, cls.parse_book_id)
+
+    @classmethod
+    def parse_book_id(cls, body):
+        et = html.fromstring(body)
 
         # pick out the link that _should_ point at the book's ID
         book_paths = et.xpath(cls.xpath_search_item_all + "//a[contains(concat(' ',normalize-space(@class),' '),' bc-link ')][starts-with(@href,'/pd/')][img]/@href")
@@ -69,8 +84,11 @@ class ProductHelper:
     @classmethod
     def get_product_id(cls, domain, book_id):
         url = cls.get_book_url(domain, book_id)
-        with urllib.request.urlopen(url) as book_req:
-            et = html.fromstring(book_req.read())
+        return cls.get_fetcher().get(url, cls.parse_product_id)
+
+    @classmethod
+    def parse_product_id(cls, body):
+        et = html.fromstring(body)
 
         info_json_raw = et.xpath(cls.xpath_product_info_json)
         if len(info_json_raw) < 1:
@@ -91,21 +109,16 @@ class ProductHelper:
 
     @classmethod
     def get_book_metadata(cls, domain, book_id):
-        data = {
-            'title': None,
-            'author': None,
-            'narrator': None,
-            'series': None,
-            'publisher': None,
-        }
-
         # load the book's page
         url = cls.get_search_url(domain, book_id)
         if config.debug:
             print('Retrieving book metadata from [%s]' % ( url ), file=stderr)
 
-        with urllib.request.urlopen(url) as search_req:
-            et = html.fromstring(search_req.read())
+        return cls.get_fetcher().get(url, cls.parse_book_metadata)
+
+    @classmethod
+    def parse_book_metadata(cls, body):
+        et = html.fromstring(body)
 
         #with open('x.html', 'wb') as f:
         #    f.write(html.tostring(et))
@@ -0,0 +1,49 @@
+class OutputProfile:
+    # describes how the chapters are written... the codec, the container, and
+    # whether the audio is re-encoded at all
+    #
+    # 'picture' is how the cover is embedded... as a METADATA_BLOCK_PICTURE
+    # 'comment', or as an attached picture 'stream'
+    def __init__(self, name, extension, codec, muxer, bitrate=True, copy=False, picture='stream'):
+        self.name = name
+        self.extension = extension
+        self.codec = codec
+        self.muxer = muxer
+        self.bitrate = bitrate
+        self.copy = copy
+        self.picture = picture
+
+    def __repr__(self):
+        return '<OutputProfile %s>' % ( self.name )
+
+    def for_codec(self, codec):
+        # the passthrough profiles can only put the stream in a container that
+        # suits it... MP3 can't go in to an M4A / M4B, and AAC can't go in to
+        # an MP3
+        if self.copy and codec == 'mp3':
+            return PROFILES['mp3']
+        if self.copy and self.name == 'mp3':
+            return PROFILES['m4a']
+        return self
+
+    def codec_args(self, bitrate):
+        args = [
+            '-codec:a', self.codec,
+        ]
+        if self.bitrate:
+            args.extend([
+                '-ab', '%dk' % ( bitrate ),
+            ])
+        return args
+
+    def output_args(self, bitrate):
+        return [ *self.codec_args(bitrate), '-f', self.muxer ]
+
+PROFILES = {
+    'vorbis': OutputProfile('vorbis', 'ogg',  'libvorbis', 'ogg',  picture='comment'),
+    'opus':   OutputProfile('opus',   'opus', 'libopus',   'opus', picture='comment'),
+    'flac':   OutputProfile('flac',   'flac', 'flac',      'flac', bitrate=False),
+    'm4a':    OutputProfile('m4a',    'm4a',  'copy',      'ipod', bitrate=False, copy=True),
+    'm4b':    OutputProfile('m4b',    'm4b',  'copy',      'ipod', bitrate=False, copy=True),
+    'mp3':    OutputProfile('mp3',    'mp3',  'copy',      'mp3',  bitrate=False, copy=True),
+}
@@ -0,0 +1,121 @@
+import os
+import json
+
+from aax_to_ogg.manifest import Manifest
+from aax_to_ogg.oggtag import OggFile, OggError
+
+class Retag:
+    # the tags that each part carries, from the book's metadata (see
+    # ProductHelper.get_book_metadata)... the names are ffmpeg's, and they are
+    # written as Vorbis comments just as ffmpeg would write them
+    vorbis_names = {
+        'track': 'TRACKNUMBER',
+    }
+
+    @staticmethod
+    def tracks(plan):
+        # each part's track number is its place in the plan, counting from 1
+        # (whether or not there is a snipped intro, numbered 0)
+        return { num: i + 1 for i, num in enumerate(sorted(part['num'] for part in plan)) }
+
+    @staticmethod
+    def tags(book_metadata, track=None, title=None, count=None):
+        series_book = book_metadata.get('series_book')
+        if isinstance(series_book, float):
+            series_book = '%g' % ( series_book )
+
+        tags = {
+            'album':       book_metadata.get('title'),
+            'artist':      book_metadata.get('author'),
+            'performer':   book_metadata.get('narrator'),
+            'series':      book_metadata.get('series'),
+            'series_book': series_book,
+        }
+
+        if title is not None:
+            tags['title'] = title
+        if track is not None and count is not None:
+            tags['track'] = '%d/%d' % ( track, count )
+
+        return tags
+
+    @classmethod
+    def vorbis_tags(cls, tags):
+        return { cls.vorbis_names.get(k, k): v for k, v in tags.items() }
+
+    @classmethod
+    def part(cls, filename, tags):
+        # returns None if the tags were already right, or whether the file was
+        # rewritten in place
+        f = OggFile(filename)
+        if not f.update(cls.vorbis_tags(tags)):
+            return None
+        return f.save()
+
+    @classmethod
+    def book(cls, manifest_filename):
+        # returns ( parts retagged, of them in place, unchanged, skipped )
+        book_dir = os.path.dirname(manifest_filename)
+        book_id = os.path.basename(manifest_filename)[:-len('.manifest.json')]
+
+        metadata_filename = os.path.join(book_dir, '%s.json' % ( book_id ))
+        if not os.path.exists(metadata_filename):
+            print('    NOTE: [%s] has no metadata... skipping' % ( book_id ))
+            return 0, 0, 0, 0
+
+        with open(metadata_filename, 'r') as f:
+            book_metadata = json.load(f)
+
+        manifest = Manifest(manifest_filename)
+
+        # older manifests don't have the plan, so their parts have no titles
+        plan = manifest.get('plan') or []
+        titles = { part['num']: part['title'] for part in plan }
+        tracks = cls.tracks(plan)
+
+        counts = [ 0, 0, 0, 0 ]
+        for key, record in sorted(manifest.get('parts').items(), key=lambda item: int(item[0])):
+            if record['status'] != 'done':
+                continue
+
+            num = int(key)
+            filename = os.path.join(book_dir, record['filename'])
+            tags = cls.tags(book_metadata, tracks.get(num), titles.get(num), len(plan))
+
+            try:
+                in_place = cls.part(filename, tags)
+            except ( OggError, OSError ) as e:
+                if os.path.splitext(filename)[1] in ( '.ogg', '.opus' ):
+                    print('    ERROR: unable to retag [%s]... %s' % ( record['filename'], e ))
+                counts[3] += 1
+                continue
+
+            if in_place is None:
+                counts[2] += 1
+                continue
+
+            manifest.retagged(num, filename)
+            counts[0] += 1
+            if in_place:
+                counts[1] += 1
+
+        return tuple(counts)
+
+    @classmethod
+    def library(cls, library):
+        # applies each book's metadata to its parts, as they are... only the
+        # Ogg formats (Vorbis, Opus) can be retagged
+        totals = [ 0, 0, 0, 0 ]
+
+        for dirpath, dirnames, filenames in os.walk(library):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if not filename.endswith('.manifest.json'):
+                    continue
+
+                print('Retagging [%s]...' % ( os.path.join(dirpath, filename[:-len('.manifest.json')]) ))
+                counts = cls.book(os.path.join(dirpath, filename))
+                totals = [ a + b for a, b in zip(totals, counts) ]
+
+        print('Retagged %d parts (%d in place), %d unchanged, %d skipped' % tuple(totals))
+        return totals
@@ -0,0 +1,235 @@
+import time
+import threading
+
+class JobFailed(Exception):
+    pass
+
+class Job:
+    def __init__(self, kind, func, args, kwargs, deps, label, group, cost, retries):
+        self.kind = kind
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.deps = list(deps)
+        self.label = label
+        self.group = group
+        self.cost = cost
+        self.retries = retries
+
+        self.state = 'pending'
+        self.result = None
+        self.error = None
+
+        self.attempts = 0
+        self.not_before = 0
+
+    def __repr__(self):
+        return '<Job %s [%s] %s>' % ( self.kind, self.label, self.state )
+
+    def is_ready(self):
+        return all(dep.state == 'done' for dep in self.deps)
+
+    def is_blocked(self):
+        return any(dep.state == 'failed' for dep in self.deps)
+
+    def is_finished(self):
+        return self.state in ( 'done', 'failed' )
+
+class Scheduler:
+    # lower runs first... the cheap jobs that unlock more work (e.g: the next
+    # book's metadata and probe) are preferred over the long running encodes.
+    # within a kind, the job with the highest (predicted) cost goes first, so
+    # that a long chapter isn't left until the end with the other workers idle
+    kind_priority = {
+        'metadata': 0,
+        'probe':    1,
+        'download': 2,
+        'cover':    2,
+        'convert':  3,
+        'loudness': 3,
+        'chapter':  4,
+        'split':    4,
+        'catalog':  5,
+        'tidy':     5,
+    }
+
+    # jobs that spend their time waiting on the network get their own workers,
+    # so that they don't hold up (or get held up by) the encodes
+    kind_pool = {
+        'metadata': 'net',
+        'download': 'net',
+    }
+
+    # if given, limit(workers) returns how many of the 'cpu' workers may be
+    # busy right now (see Governor.concurrency)
+    #
+    # a job that fails is run again (up to its number of retries), waiting
+    # longer each time... starting with retry_backoff seconds
+    def __init__(self, workers, net_workers=1, limit=None, retry_backoff=5.0):
+        self.cond = threading.Condition()
+
+        self.pending = []
+        self.jobs = []
+        self.running = 0
+        self.running_pool = { 'cpu': 0, 'net': 0 }
+        self.closing = False
+
+        self.cpu_workers = max(1, workers)
+        self.limit = limit
+        self.retry_backoff = retry_backoff
+
+        pools = [ ( 'cpu', workers ), ( 'net', net_workers ) ]
+
+        self.workers = [
+            threading.Thread(target=self._worker, args=( pool, ), daemon=True)
+            for pool, count in pools
+            for _ in range(max(1, count))
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, kind, func, *args, deps=(), label=None, group=None, cost=0, retries=0, **kwargs):
+        job = Job(kind, func, args, kwargs, deps, label, group, cost, retries)
+
+        with self.cond:
+            if self.closing:
+                raise Exception('scheduler is closed...')
+            self.jobs.append(job)
+            self.pending.append(job)
+            self.cond.notify_all()
+
+        return job
+
+    def _pick(self, pool):
+        # called with the lock held... returns the best job that can run now
+        best = None
+        now = time.monotonic()
+
+        for job in list(self.pending):
+            if job.is_blocked():
+                self.pending.remove(job)
+                job.state = 'failed'
+                job.error = JobFailed('a job that this depends on failed...')
+                self.cond.notify_all()
+                continue
+
+            if not job.is_ready() or job.not_before > now:
+                continue
+
+            if self.kind_pool.get(job.kind, 'cpu') != pool:
+                continue
+
+            if best is None or self.rank(job) < self.rank(best):
+                best = job
+
+        if best is not None and pool == 'cpu' and self.limit is not None:
+            if self.running_pool['cpu'] >= self.limit(self.cpu_workers):
+                return None
+
+        return best
+
+    def _wait_timeout(self):
+        # called with the lock held
+        if self.limit is not None:
+            return 1.0
+
+        now = time.monotonic()
+        delays = [ job.not_before - now for job in self.pending if job.not_before > now ]
+        if len(delays) > 0:
+            return min(delays)
+
+        return None
+
+    def rank(self, job):
+        return ( self.kind_priority.get(job.kind, 5), -job.cost )
+
+    def _worker(self, pool):
+        while True:
+            with self.cond:
+                job = self._pick(pool)
+                while job is None:
+                    if self.closing and len(self.pending) == 0:
+                        return
+                    # the limit may be raised (or a retry become due) without
+                    # anything else changing
+                    self.cond.wait(self._wait_timeout())
+                    job = self._pick(pool)
+
+                self.pending.remove(job)
+                job.state = 'running'
+                job.attempts += 1
+                self.running += 1
+                self.running_pool[pool] += 1
+
+            try:
+                result = job.func(*job.args, **job.kwargs)
+            except Exception as e:
+                state, result, error = 'failed', None, e
+            else:
+                state, result, error = 'done', result, None
+
+            with self.cond:
+                if state == 'failed' and job.attempts <= job.retries:
+                    delay = self.retry_backoff * 2 ** ( job.attempts - 1 )
+                    print('    NOTE: retrying %s in %ds... %s' % ( job.label, delay, error ))
+
+                    state = 'pending'
+                    job.not_before = time.monotonic() + delay
+                    self.pending.append(job)
+
+                job.state = state
+                job.result = result
+                job.error = error
+                self.running -= 1
+                self.running_pool[pool] -= 1
+                self.cond.notify_all()
+
+    def wait(self, job):
+        with self.cond:
+            while not job.is_finished():
+                self.cond.wait()
+
+        if job.state == 'failed':
+            raise job.error
+        return job.result
+
+    def join(self):
+        # wait for everything that has been submitted (including anything that
+        # is submitted by running jobs) to finish
+        with self.cond:
+            while len(self.pending) > 0 or self.running > 0:
+                self.cond.wait()
+
+    def close(self):
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+
+        for worker in self.workers:
+            worker.join()
+
+    def is_idle(self):
+        with self.cond:
+            return len(self.pending) == 0 and self.running == 0
+
+    def failures(self):
+        with self.cond:
+            return [ job for job in self.jobs if job.state == 'failed' and not isinstance(job.error, JobFailed) ]
+
+    def reap(self):
+        # forgets the groups (i.e: books) whose jobs have all finished, and
+        # returns them as { group: jobs }... a long running process would
+        # otherwise hold on to every job forever
+        with self.cond:
+            groups = {}
+            for job in self.jobs:
+                groups.setdefault(job.group, []).append(job)
+
+            finished = {
+                group: jobs
+                for group, jobs in groups.items()
+                if all(job.is_finished() for job in jobs)
+            }
+            self.jobs = [ job for job in self.jobs if job.group not in finished ]
+
+        return finished
@@ -0,0 +1,146 @@
+import threading
+import subprocess
+
+from aax_to_ogg.cache import Store
+from aax_to_ogg import process
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class SnipDetector:
+    # finds where the "This is Audible" intro ends, and where the "Audible
+    # hopes you have enjoyed..." outro starts, from the audio itself... only
+    # the first and last few seconds are decoded (as 8 kHz mono PCM), and the
+    # branding is taken to be the sound before the first gap (or after the
+    # last one). the results are cached by book ID
+    #
+    # this needs NumPy... without it, the fixed lengths are used
+    store = None
+    store_lock = threading.Lock()
+
+    edge_len = 15.0         # seconds decoded at each end
+    rate = 8000
+    frame_len = 0.01        # seconds per level measurement
+
+    silence_db = -50.0      # always silent
+    loud_db = -25.0         # never silent
+    floor_margin = 6.0      # above the quietest part of the edge
+
+    min_sound = 0.5         # the branding lasts at least this long...
+    min_gap = 0.25          # ...and is followed (or preceded) by this much silence
+    max_lead = 0.2          # silence left before / after the cut
+
+    @staticmethod
+    def available():
+        return numpy is not None
+
+    @classmethod
+    def get_store(cls):
+        with cls.store_lock:
+            if cls.store is None:
+                cls.store = Store('snip')
+            return cls.store
+
+    @classmethod
+    def cached(cls, book_id):
+        # returns ( intro, outro ) if the book has been looked at before... either
+        # can be None, if it wasn't found
+        found = cls.get_store().get(book_id)
+        if found is None:
+            return None
+        return found['intro'], found['outro']
+
+    @classmethod
+    def detect(cls, book_id, input_filename, activation_bytes, t_start, t_end, timeout=None):
+        found = cls.cached(book_id)
+        if found is not None:
+            return found
+
+        edge_len = min(cls.edge_len, ( t_end - t_start ) / 2)
+
+        head = cls.levels(cls.decode(input_filename, activation_bytes, t_start, edge_len, timeout=timeout))
+        tail = cls.levels(cls.decode(input_filename, activation_bytes, t_end - edge_len, edge_len, timeout=timeout))
+
+        intro = cls.find_intro(head)
+        outro = cls.find_intro(tail[::-1])
+
+        cls.get_store().set(book_id, { 'intro': intro, 'outro': outro })
+        return intro, outro
+
+    @classmethod
+    def decode(cls, input_filename, activation_bytes, t_start, duration, timeout=None):
+        args = [
+            'ffmpeg',
+            '-loglevel', 'error',
+        ]
+        if activation_bytes is not None:
+            args.extend([
+                '-activation_bytes', activation_bytes,
+            ])
+        args.extend([
+            '-ss', '%.6f' % ( t_start ),
+            '-i', input_filename,
+            '-t', '%.6f' % ( duration ),
+            '-vn',
+            '-ac', '1',
+            '-ar', '%d' % ( cls.rate ),
+            '-codec:a', 'pcm_s16le',
+            '-f', 's16le',
+            'pipe:1',
+        ])
+
+        p = process.run(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, timeout=timeout)
+        if p.returncode != 0:
+            raise Exception('unable to decode the audio for snipping...%s' % ( ' (timed out)' if p.timed_out else '' ))
+
+        return numpy.frombuffer(p.stdout, dtype='<i2')
+
+    @classmethod
+    def levels(cls, samples):
+        # the level of each frame, in dBFS
+        frame = int(cls.rate * cls.frame_len)
+        count = len(samples) // frame
+
+        frames = samples[:count * frame].reshape(count, frame).astype(numpy.float32) / 32768
+        rms = numpy.sqrt(numpy.mean(frames * frames, axis=1))
+
+        return 20 * numpy.log10(rms + 1e-10)
+
+    @classmethod
+    def find_intro(cls, levels):
+        # returns how many seconds in to cut, or None... the levels run away
+        # from the edge (so the outro's are reversed)
+        if len(levels) == 0:
+            return None
+
+        # what counts as silence depends on the noise floor
+        threshold = numpy.percentile(levels, 5) + cls.floor_margin
+        threshold = min(max(threshold, cls.silence_db), cls.loud_db)
+        silent = levels < threshold
+
+        # the start / end of each run of silence
+        edges = numpy.diff(numpy.concatenate(( [ 0 ], silent.astype(numpy.int8), [ 0 ] )))
+        starts = numpy.flatnonzero(edges == 1)
+        ends = numpy.flatnonzero(edges == -1)
+
+        # how much sound came before each frame
+        sound = numpy.concatenate(( [ 0 ], numpy.cumsum(~silent) ))
+
+        min_sound = int(cls.min_sound / cls.frame_len)
+        min_gap = int(cls.min_gap / cls.frame_len)
+
+        for start, end in zip(starts, ends):
+            if end - start < min_gap or sound[start] < min_sound:
+                continue
+
+            # the gap can't run to the end of what was decoded, or we can't
+            # tell that anything follows it
+            if end == len(levels):
+                return None
+
+            lead = min(int(cls.max_lead / cls.frame_len), ( end - start ) // 2)
+            return round(float(( end - lead ) * cls.frame_len), 3)
+
+        return None
@@ -0,0 +1,99 @@
+import os
+import sys
+import struct
+import shutil
+import tempfile
+import subprocess
+import importlib.util
+
+import pytest
+
+# the repository is the 'aax_to_ogg' package itself, so it's imported from
+# here... and the options are parsed as it is imported, so they are given
+# first (with a cache and a library of their own)
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+scratch = tempfile.mkdtemp(prefix='aax_to_ogg-tests-')
+
+sys.argv = [
+    'aax_to_ogg',
+    '--cache-dir', os.path.join(scratch, 'cache'),
+    '--library', os.path.join(scratch, 'library'),
+    '--list',
+]
+
+if 'aax_to_ogg' not in sys.modules:
+    spec = importlib.util.spec_from_file_location('aax_to_ogg', os.path.join(root, '__init__.py'), submodule_search_locations=[ root ])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['aax_to_ogg'] = module
+    spec.loader.exec_module(module)
+
+def pytest_unconfigure(config):
+    shutil.rmtree(scratch, ignore_errors=True)
+
+@pytest.fixture
+def ffmpeg():
+    if shutil.which('ffmpeg') is None:
+        pytest.skip('needs ffmpeg')
+
+    def run(*args):
+        p = subprocess.run([ 'ffmpeg', '-y', '-loglevel', 'error', *args ], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        assert p.returncode == 0, p.stderr.decode('utf-8', 'replace')
+        return p.stdout
+
+    return run
+
+@pytest.fixture
+def sine(ffmpeg, tmp_path):
+    # a few seconds of tone, as a WAV file
+    filename = str(tmp_path / 'sine.wav')
+    ffmpeg('-f', 'lavfi', '-i', 'sine=frequency=440:duration=6:sample_rate=44100', filename)
+    return filename
+
+@pytest.fixture
+def m4a(ffmpeg, tmp_path):
+    # an AAC book with chapters, and some metadata... the 'moov' is written
+    # after the 'mdat', as ffmpeg does by default
+    metadata = str(tmp_path / 'chapters.ffmetadata')
+    with open(metadata, 'w') as f:
+        f.write(';FFMETADATA1\ntitle=Test Book\nartist=Some Author\n')
+        for t_start, t_end, title in [ ( 0, 2000, 'One' ), ( 2000, 5000, 'Two' ), ( 5000, 6000, 'Three' ) ]:
+            f.write('[CHAPTER]\nTIMEBASE=1/1000\nSTART=%d\nEND=%d\ntitle=%s\n' % ( t_start, t_end, title ))
+
+    filename = str(tmp_path / 'book.m4a')
+    ffmpeg('-f', 'lavfi', '-i', 'sine=frequency=440:duration=6:sample_rate=44100', '-i', metadata, '-map_metadata', '1', '-map_chapters', '1', '-codec:a', 'aac', '-b:a', '64k', filename)
+    return filename
+
+@pytest.fixture
+def make_aax(m4a, tmp_path):
+    # returns a function that writes the book as an AAX would be... its audio
+    # sample description becomes 'aavd', with an 'adrm' box that holds the
+    # given checksum (the DRM blob is left empty)
+    from aax_to_ogg.mp4 import Mp4File
+
+    def make(checksum, name='book.aax'):
+        with Mp4File(m4a) as f:
+            data = bytearray(f.buf)
+
+            moov = f.find(b'moov')
+            assert moov[0] > f.find(b'mdat')[0], 'the chunk offsets would move'
+
+            parents = [ moov ]
+            for name_ in ( b'trak', b'mdia', b'minf', b'stbl', b'stsd' ):
+                parents.append(f.find(name_, start=parents[-1][0], end=parents[-1][1]))
+            _, e_start, e_end, _ = next(f.sample_entries(parents[-2]))
+
+        payload = b'\x00' * 68 + checksum + b'\x00' * 8
+        adrm = struct.pack('>I4s', 8 + len(payload), b'adrm') + payload
+
+        data[e_start - 4:e_start] = b'aavd'
+        data[e_end:e_end] = adrm
+        for start, _ in [ *parents, ( e_start, e_end ) ]:
+            size, = struct.unpack_from('>I', data, start - 8)
+            struct.pack_into('>I', data, start - 8, size + len(adrm))
+
+        filename = str(tmp_path / name)
+        with open(filename, 'wb') as f:
+            f.write(data)
+        return filename
+
+    return make
@@ -0,0 +1,47 @@
+import subprocess
+
+import pytest
+
+from aax_to_ogg.args import config
+from aax_to_ogg.activation import ActivationHelper
+from aax_to_ogg.mp4 import Mp4File
+
+def ffmpeg_checksum_error(filename, activation_bytes):
+    # ffmpeg checks the activation bytes against the 'adrm' checksum before
+    # anything else... and says so if they don't match
+    p = subprocess.run([ 'ffmpeg', '-activation_bytes', activation_bytes, '-i', filename, '-f', 'null', '-' ], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = p.stderr.decode('utf-8', 'replace')
+    assert 'file checksum' in stderr
+    return 'mismatch in checksums' in stderr
+
+@pytest.mark.parametrize('activation_bytes', [ '', '1ceb00', '1ceb00da00', 'not hex!' ])
+def test_bad_activation_bytes(activation_bytes):
+    assert ActivationHelper.checksum_for(activation_bytes) is None
+
+def test_checksum_is_case_insensitive():
+    checksum = ActivationHelper.checksum_for('1ceb00da')
+    assert len(checksum) == 20
+    assert ActivationHelper.checksum_for('1CEB00DA') == checksum
+    assert ActivationHelper.checksum_for('1ceb00db') != checksum
+
+def test_checksum_matches_ffmpeg(make_aax):
+    filename = make_aax(ActivationHelper.checksum_for('1ceb00da'))
+
+    with Mp4File(filename) as f:
+        assert f.adrm_checksum() == ActivationHelper.checksum_for('1ceb00da')
+
+    assert not ffmpeg_checksum_error(filename, '1ceb00da')
+    assert ffmpeg_checksum_error(filename, '1ceb00db')
+
+def test_resolve(monkeypatch):
+    monkeypatch.setattr(config, 'activation_bytes', [ '00000000', 'c0ffee00' ])
+    checksum = ActivationHelper.checksum_for('c0ffee00')
+
+    assert ActivationHelper.resolve(checksum) == 'c0ffee00'
+    assert ActivationHelper.get_store().get(checksum.hex()) == 'c0ffee00'
+
+    # once it has been seen, it doesn't need to be given
+    monkeypatch.setattr(config, 'activation_bytes', [])
+    assert ActivationHelper.resolve(checksum) == 'c0ffee00'
+
+    assert ActivationHelper.resolve(ActivationHelper.checksum_for('0badf00d')) is None
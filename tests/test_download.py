@@ -0,0 +1,141 @@
+import os
+import re
+import json
+import threading
+import http.server
+
+import pytest
+
+from aax_to_ogg.download import Downloader
+
+DATA = os.urandom(2 * 1024 * 1024 + 12345)
+
+@pytest.fixture
+def server():
+    # serves DATA... with ranges (unless told not to), and can cut the next
+    # few responses off half way through
+    state = { 'ranges': True, 'drops': 0, 'served': 0, 'requests': [] }
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            m = re.match('^bytes=(?P<start>[0-9]+)-(?P<end>[0-9]*)$', self.headers.get('Range', ''))
+            state['requests'].append(self.headers.get('Range'))
+
+            if m is not None and state['ranges']:
+                start = int(m.group('start'))
+                end = int(m.group('end')) + 1 if m.group('end') else len(DATA)
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes %d-%d/%d' % ( start, end - 1, len(DATA) ))
+            else:
+                start, end = 0, len(DATA)
+                self.send_response(200)
+
+            body = DATA[start:end]
+            self.send_header('Content-Length', '%d' % ( len(body) ))
+            self.end_headers()
+
+            if state['drops'] > 0 and len(body) > 1:
+                state['drops'] -= 1
+                body = body[:len(body) // 2]
+                self.close_connection = True
+
+            self.wfile.write(body)
+            state['served'] += len(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = http.server.ThreadingHTTPServer(( '127.0.0.1', 0 ), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    yield 'http://127.0.0.1:%d/book.aax' % ( httpd.server_address[1] ), state
+
+    httpd.shutdown()
+    httpd.server_close()
+
+def read(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+def test_ranges(server, tmp_path):
+    url, state = server
+    target = str(tmp_path / 'book.aax')
+
+    progress = []
+    d = Downloader(url, target, connections=4, progress=lambda done, size: progress.append(( done, size )))
+    assert d.run() == target
+
+    assert read(target) == DATA
+    assert not os.path.exists('%s.part' % ( target ))
+    assert not os.path.exists('%s.part.json' % ( target ))
+    assert progress[-1] == ( len(DATA), len(DATA) )
+
+    # the size, then one request per connection
+    assert len(state['requests']) == 1 + 4
+
+def test_resume(server, tmp_path):
+    url, state = server
+    target = str(tmp_path / 'book.aax')
+
+    # every range is cut off half way through
+    state['drops'] = 4
+    with pytest.raises(Exception, match='connection closed early'):
+        Downloader(url, target, connections=4).run()
+
+    assert not os.path.exists(target)
+    with open('%s.part.json' % ( target ), 'r') as f:
+        saved = json.load(f)
+    assert saved['size'] == len(DATA)
+    assert all(r['start'] < r['pos'] < r['end'] for r in saved['ranges'])
+
+    # only what is missing is fetched the second time
+    state['served'] = 0
+    assert Downloader(url, target, connections=4).run() == target
+
+    assert read(target) == DATA
+    assert state['served'] == 1 + sum(r['end'] - r['pos'] for r in saved['ranges'])
+    assert not os.path.exists('%s.part.json' % ( target ))
+
+def test_resume_after_the_size_changes(server, tmp_path):
+    url, state = server
+    target = str(tmp_path / 'book.aax')
+
+    with open('%s.part' % ( target ), 'wb') as f:
+        f.write(b'x' * 100)
+    with open('%s.part.json' % ( target ), 'w') as f:
+        json.dump({ 'url': url, 'size': 100, 'ranges': [ { 'start': 0, 'end': 100, 'pos': 50 } ] }, f)
+
+    Downloader(url, target, connections=2).run()
+    assert read(target) == DATA
+
+def test_no_ranges(server, tmp_path):
+    url, state = server
+    target = str(tmp_path / 'book.aax')
+    state['ranges'] = False
+
+    assert Downloader(url, target, connections=4).run() == target
+    assert read(target) == DATA
+
+def test_no_ranges_truncated(server, tmp_path):
+    url, state = server
+    target = str(tmp_path / 'book.aax')
+    state['ranges'] = False
+    state['drops'] = 2
+
+    with pytest.raises(Exception, match='truncated'):
+        Downloader(url, target, connections=4).run()
+    assert not os.path.exists(target)
+
+def test_stream(server, tmp_path):
+    url, state = server
+    target = str(tmp_path / 'book.aax')
+
+    received = []
+    assert Downloader(url, target, connections=4).stream(received.append) == target
+
+    assert b''.join(received) == DATA
+    assert read(target) == DATA
+    assert state['requests'] == [ None ]
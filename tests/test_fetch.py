@@ -0,0 +1,85 @@
+import time
+import threading
+import http.server
+
+import pytest
+
+from aax_to_ogg.fetch import Fetcher
+
+@pytest.fixture
+def server():
+    requests = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            requests.append(self.path)
+            time.sleep(0.2)
+
+            body = ( 'body of %s' % ( self.path ) ).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Length', '%d' % ( len(body) ))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = http.server.ThreadingHTTPServer(( '127.0.0.1', 0 ), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    yield 'http://127.0.0.1:%d' % ( httpd.server_address[1] ), requests
+
+    httpd.shutdown()
+    httpd.server_close()
+
+def in_threads(func, count=8):
+    results = [ None ] * count
+
+    def run(i):
+        results[i] = func()
+
+    threads = [ threading.Thread(target=run, args=( i, )) for i in range(count) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+def test_concurrent_fetches_share_one_request(server):
+    base, requests = server
+    f = Fetcher()
+
+    results = in_threads(lambda: f.fetch('%s/same' % ( base )))
+
+    assert requests == [ '/same' ]
+    assert all(result[2] == b'body of /same' for result in results)
+
+def test_concurrent_gets_parse_once(server):
+    base, requests = server
+    f = Fetcher()
+    parsed = []
+
+    def parse(body):
+        parsed.append(body)
+        return body.decode('utf-8')
+
+    results = in_threads(lambda: f.get('%s/parsed' % ( base ), parse))
+
+    assert requests == [ '/parsed' ]
+    assert len(parsed) == 1
+    assert results == [ 'body of /parsed' ] * 8
+
+def test_different_urls_are_fetched_at_once(server):
+    base, requests = server
+    f = Fetcher()
+
+    t = time.time()
+    counter = iter(range(8))
+    in_threads(lambda: f.fetch('%s/%d' % ( base, next(counter) )))
+
+    assert sorted(requests) == sorted('/%d' % ( i ) for i in range(8))
+    assert time.time() - t < 0.2 * 8
@@ -0,0 +1,91 @@
+import struct
+
+import pytest
+
+from aax_to_ogg.mp4 import Mp4File, Mp4Error
+
+def box(box_type, payload=b''):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+def large_box(box_type, payload=b''):
+    # with a 64 bit size
+    return struct.pack('>I4sQ', 1, box_type, 16 + len(payload)) + payload
+
+ftyp = box(b'ftyp', b'M4A \x00\x00\x00\x00M4A isom')
+
+@pytest.fixture
+def write(tmp_path):
+    def write(data):
+        filename = str(tmp_path / 'test.mp4')
+        with open(filename, 'wb') as f:
+            f.write(data)
+        return filename
+    return write
+
+def test_boxes(write):
+    data = ftyp + box(b'moov', box(b'trak', box(b'tkhd', b'x' * 4)) + large_box(b'trak', b'y' * 3)) + box(b'free')
+
+    with Mp4File(write(data)) as f:
+        top = [ ( box_type, end - start ) for box_type, start, end in f.boxes() ]
+        assert top == [ ( b'ftyp', 16 ), ( b'moov', 12 + 8 + 19 ), ( b'free', 0 ) ]
+
+        moov = f.find(b'moov')
+        assert [ ( box_type, end - start ) for box_type, start, end in f.boxes(*moov) ] == [ ( b'trak', 12 ), ( b'trak', 3 ) ]
+
+        start, end = f.find(b'moov', b'trak', b'tkhd')
+        assert f.buf[start:end] == b'x' * 4
+
+        assert [ bytes(f.buf[start:end]) for start, end in f.find_all(b'moov', b'trak') ] == [ box(b'tkhd', b'x' * 4), b'y' * 3 ]
+        assert f.find(b'moov', b'mvhd') is None
+
+def test_box_to_end_of_file(write):
+    # a size of 0 runs to the end of the parent
+    data = ftyp + struct.pack('>I4s', 0, b'mdat') + b'z' * 10
+
+    with Mp4File(write(data)) as f:
+        start, end = f.find(b'mdat')
+        assert f.buf[start:end] == b'z' * 10
+
+@pytest.mark.parametrize('data', [
+    ftyp + struct.pack('>I4s', 100, b'moov') + b'\x00' * 10,
+    ftyp + struct.pack('>I4s', 4, b'moov'),
+    ftyp + struct.pack('>I4s', 1, b'moov') + b'\x00' * 4,
+])
+def test_truncated(data, write):
+    with Mp4File(write(data)) as f:
+        with pytest.raises(Mp4Error):
+            list(f.boxes())
+
+@pytest.mark.parametrize('data', [ b'', box(b'moov'), b'OggS' + b'\x00' * 100 ])
+def test_not_mp4(data, write):
+    with pytest.raises(Mp4Error):
+        Mp4File(write(data))
+
+def test_probe(m4a):
+    with Mp4File(m4a) as f:
+        info = f.probe()
+        assert f.adrm_checksum() is None
+
+    assert info['duration'] == pytest.approx(6, abs=0.1)
+    assert info['metadata']['title'] == 'Test Book'
+    assert info['metadata']['artist'] == 'Some Author'
+
+    assert [ c['title'] for c in info['chapters'] ] == [ 'One', 'Two', 'Three' ]
+    assert [ c['t_start'] for c in info['chapters'] ] == pytest.approx([ 0, 2, 5 ], abs=0.05)
+    assert info['chapters'][-1]['t_end'] == pytest.approx(info['duration'], abs=0.1)
+
+    audio = [ s for s in info['streams'] if s['type'] == 'Audio' ]
+    assert len(audio) == 1
+    assert audio[0]['codec'] == 'aac'
+    assert audio[0]['sample_rate'] == 44100
+    assert audio[0]['channels'] == 1
+
+def test_probe_aax(make_aax):
+    with Mp4File(make_aax(b'\x01' * 20)) as f:
+        info = f.probe()
+        assert f.adrm_checksum() == b'\x01' * 20
+
+    audio = [ s for s in info['streams'] if s['type'] == 'Audio' ]
+    assert audio[0]['format'] == 'aavd'
+    assert audio[0]['codec'] == 'aac'
+    assert [ c['title'] for c in info['chapters'] ] == [ 'One', 'Two', 'Three' ]
@@ -0,0 +1,130 @@
+import os
+import subprocess
+
+import pytest
+
+from aax_to_ogg.oggtag import OggFile, OggPage, OggError, ogg_crc, lace
+
+@pytest.fixture(params=[ ( 'libvorbis', 'ogg' ), ( 'libopus', 'opus' ) ])
+def ogg(request, ffmpeg, sine, tmp_path):
+    codec, muxer = request.param
+    filename = str(tmp_path / ( 'part.%s' % ( muxer ) ))
+    ffmpeg('-i', sine, '-codec:a', codec, '-metadata', 'title=Old Title', '-metadata', 'artist=Someone', '-f', muxer, filename)
+    return filename
+
+def pages(filename):
+    # ( page, its raw bytes ) for each page in the file
+    found = []
+    with open(filename, 'rb') as f:
+        while True:
+            pos = f.tell()
+            page = OggPage.read(f)
+            if page is None:
+                return found
+            end = f.tell()
+            f.seek(pos)
+            found.append(( page, f.read(end - pos) ))
+
+def decode(filename):
+    # the samples, checking every page's CRC on the way
+    p = subprocess.run([ 'ffmpeg', '-loglevel', 'error', '-err_detect', 'crccheck', '-i', filename, '-f', 's16le', '-' ], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert p.returncode == 0
+    assert b'CRC' not in p.stderr and b'checksum' not in p.stderr
+    return p.stdout
+
+def audio(filename, f_ogg):
+    with open(filename, 'rb') as f:
+        f.seek(f_ogg.header_size)
+        return f.read()
+
+def test_crc():
+    # the CRC of the CRC's own polynomial (as a check value)
+    assert ogg_crc(b'') == 0
+    assert ogg_crc(b'123456789') == 0x89a1897f
+
+def test_lace():
+    assert lace(b'') == [ 0 ]
+    assert lace(b'x' * 254) == [ 254 ]
+    assert lace(b'x' * 255) == [ 255, 0 ]
+    assert lace(b'x' * 600) == [ 255, 255, 90 ]
+
+def test_pages_round_trip(ogg):
+    # each page comes out just as ffmpeg wrote it, CRC and all
+    found = pages(ogg)
+    assert len(found) > 2
+    for page, raw in found:
+        assert bytes(page) == raw
+
+@pytest.mark.parametrize('delta', [ 1, 3, -1, 1000 ])
+def test_renumber(ogg, delta):
+    for page, raw in pages(ogg)[1:]:
+        if page.seq + delta < 0:
+            continue
+        renumbered = OggPage.renumber(raw, delta)
+        expected = OggPage(page.header_type, page.granule, page.serial, page.seq + delta, page.lacing, page.data)
+        assert renumbered == bytes(expected)
+
+def test_read_comments(ogg):
+    f = OggFile(ogg)
+    assert f.get('title') == [ 'Old Title' ]
+    assert f.get('ARTIST') == [ 'Someone' ]
+    assert f.get('album') == []
+
+def test_update(ogg):
+    f = OggFile(ogg)
+    assert not f.update({ 'TITLE': 'Old Title' })
+    assert f.update({ 'title': 'New Title', 'artist': None, 'album': 'The Book' })
+
+    assert f.get('title') == [ 'New Title' ]
+    assert f.get('artist') == []
+    assert f.get('album') == [ 'The Book' ]
+
+def test_save_in_place(ogg):
+    samples = decode(ogg)
+
+    # ffmpeg doesn't pad the comments... so make room first
+    f = OggFile(ogg)
+    f.update({ 'album': 'x' * 100 })
+    assert not f.save()
+    size = os.path.getsize(ogg)
+    audio_before = audio(ogg, f)
+
+    f = OggFile(ogg)
+    f.update({ 'album': 'The Book', 'title': 'New Title' })
+    assert f.save()
+    assert os.path.getsize(ogg) == size
+    assert audio(ogg, f) == audio_before
+
+    assert decode(ogg) == samples
+    f = OggFile(ogg)
+    assert f.get('album') == [ 'The Book' ]
+    assert f.get('title') == [ 'New Title' ]
+    assert f.get('artist') == [ 'Someone' ]
+
+@pytest.mark.parametrize('length', [ 1000, 200000 ])
+def test_save_rebuilt(ogg, length):
+    # the longer comment takes more pages, so the audio's are renumbered
+    samples = decode(ogg)
+    header_pages = len(OggFile(ogg).pages)
+    audio_pages = [ page for page, raw in pages(ogg)[header_pages:] ]
+
+    f = OggFile(ogg)
+    f.update({ 'description': 'y' * length })
+    assert not f.save()
+
+    f = OggFile(ogg)
+    assert f.get('description') == [ 'y' * length ]
+    assert f.get('title') == [ 'Old Title' ]
+
+    delta = len(f.pages) - header_pages
+    assert ( delta > 0 ) == ( length > 255 * 255 )
+
+    found = pages(ogg)
+    assert [ page.seq for page, raw in found ] == list(range(len(found)))
+    assert [ ( page.granule, page.data ) for page, raw in found[len(f.pages):] ] == [ ( page.granule, page.data ) for page in audio_pages ]
+
+    assert decode(ogg) == samples
+
+def test_not_ogg(sine):
+    with pytest.raises(OggError):
+        OggFile(sine)
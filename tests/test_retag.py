@@ -0,0 +1,55 @@
+import pytest
+
+from aax_to_ogg.args import config
+from aax_to_ogg.retag import Retag
+from aax_to_ogg.filetypes.aax import AaxSplit
+
+book_metadata = {
+    'title': 'The Book',
+    'author': 'An Author',
+    'narrator': 'A Narrator',
+    'series': 'The Series',
+    'series_book': 2.0,
+}
+
+chapters = [
+    { 't_start': 0.0,   't_end': 60.0,  'title': 'One' },
+    { 't_start': 60.0,  't_end': 120.0, 'title': 'Two' },
+    { 't_start': 120.0, 't_end': 180.0, 'title': 'Three' },
+]
+
+def plan_chapters(no_snip, monkeypatch):
+    monkeypatch.setattr(config, 'no_snip', no_snip)
+    s = AaxSplit.__new__(AaxSplit)
+    s.snip = ( 2.0, 5.0 )
+    return s._plan_chapters(chapters)
+
+@pytest.mark.parametrize('no_snip', [ False, True ])
+def test_tracks_count_from_one(no_snip, monkeypatch):
+    plan = plan_chapters(no_snip, monkeypatch)
+    tracks = Retag.tracks(plan)
+
+    assert len(plan) == ( 3 if no_snip else 5 )
+    assert [ tracks[part['num']] for part in plan ] == list(range(1, len(plan) + 1))
+
+    tags = [ Retag.tags(book_metadata, tracks[part['num']], part['title'], len(tracks))['track'] for part in plan ]
+    assert tags[0] == '1/%d' % ( len(plan) )
+    assert tags[-1] == '%d/%d' % ( len(plan), len(plan) )
+
+def test_tags():
+    tags = Retag.tags(book_metadata, 2, 'Two', 3)
+
+    assert tags == {
+        'album': 'The Book',
+        'artist': 'An Author',
+        'performer': 'A Narrator',
+        'series': 'The Series',
+        'series_book': '2',
+        'title': 'Two',
+        'track': '2/3',
+    }
+    assert Retag.vorbis_tags(tags)['TRACKNUMBER'] == '2/3'
+
+def test_book_tags_have_no_track():
+    tags = Retag.tags(book_metadata)
+    assert 'track' not in tags and 'title' not in tags
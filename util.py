@@ -1,4 +1,8 @@
 import re
+import threading
+
+# held by anything that needs to interact with the user, while other jobs run
+console_lock = threading.Lock()
 
 """
     yields once for each item in iterable
@@ -46,3 +50,10 @@ def human_to_seconds(human):
         sec += float(t)
 
     return sec
+
+def seconds_to_human(seconds):
+    # the opposite of human_to_seconds() - e.g: 27442.21 becomes '07:37:22.21'
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(int(minutes), 60)
+
+    return '%02d:%02d:%05.2f' % ( hours, minutes, seconds )
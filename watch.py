@@ -0,0 +1,161 @@
+import os
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+
+class Inotify:
+    # just enough of inotify(7) to be told when a file in a directory has been
+    # written and closed, or moved in to it
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO    = 0x00000080
+    IN_Q_OVERFLOW  = 0x00004000
+
+    event = struct.Struct('iIII')
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1() failed...')
+
+        self.watches = {}
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.IN_CLOSE_WRITE | self.IN_MOVED_TO)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch() failed... [%s]' % ( path ))
+
+        self.watches[wd] = path
+
+    def read(self, timeout):
+        # returns the paths that have changed, or None if events were lost
+        r, _, _ = select.select([ self.fd ], [], [], timeout)
+        if len(r) == 0:
+            return []
+
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+
+        paths = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, name_len = self.event.unpack_from(data, pos)
+            pos += self.event.size
+
+            name = data[pos:pos + name_len].rstrip(b'\0')
+            pos += name_len
+
+            if mask & self.IN_Q_OVERFLOW:
+                return None
+
+            if wd in self.watches and len(name) > 0:
+                paths.append(os.path.join(self.watches[wd], os.fsdecode(name)))
+
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+class Watcher:
+    # watches the inbox directories for new files... a file is only handed
+    # over once it has stopped changing for 'settle' seconds, so that a copy
+    # that is still in progress isn't picked up part way through
+    #
+    # if inotify isn't available, the directories are scanned instead
+    tick = 1.0
+
+    def __init__(self, dirs, accept, settle=5.0):
+        self.dirs = [ os.path.abspath(d) for d in dirs ]
+        self.accept = accept
+        self.settle = settle
+
+        self.stopped = False
+
+        # path -> ( size, mtime, when it was last seen to change )
+        self.candidates = {}
+        # path -> ( size, mtime ) when it was handed over
+        self.handled = {}
+
+        try:
+            self.inotify = Inotify()
+            for d in self.dirs:
+                self.inotify.add_watch(d)
+        except ( OSError, AttributeError ):
+            print('WARNING: inotify is not available, scanning every %ds instead...' % ( self.tick ))
+            self.inotify = None
+
+        # anything that arrived while we weren't running
+        self.scan()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if self.inotify is not None:
+            self.inotify.close()
+
+    def stop(self):
+        self.stopped = True
+
+    def scan(self):
+        for d in self.dirs:
+            for name in os.listdir(d):
+                self.notice(os.path.join(d, name))
+
+    def notice(self, filename):
+        if not self.accept(filename):
+            return
+        self.candidates.setdefault(filename, None)
+
+    def poll(self):
+        # waits up to a tick, and returns the files that are ready to handle
+        if self.inotify is None:
+            time.sleep(self.tick)
+            self.scan()
+        else:
+            paths = self.inotify.read(self.tick)
+            if paths is None:
+                # the kernel dropped some events... have a look for ourselves
+                self.scan()
+            else:
+                for filename in paths:
+                    self.notice(filename)
+
+        now = time.monotonic()
+        ready = []
+
+        for filename, seen in list(self.candidates.items()):
+            try:
+                st = os.stat(filename)
+            except FileNotFoundError:
+                del self.candidates[filename]
+                continue
+
+            identity = ( st.st_size, st.st_mtime_ns )
+
+            if self.handled.get(filename) == identity:
+                # we've already handed this one over, and it hasn't changed
+                del self.candidates[filename]
+                continue
+
+            if seen is None or seen[:2] != identity:
+                self.candidates[filename] = ( *identity, now )
+                continue
+
+            if now - seen[2] < self.settle:
+                continue
+
+            del self.candidates[filename]
+            self.handled[filename] = identity
+            ready.append(filename)
+
+        # forget about the files that have since been moved in to the library
+        for filename in [ f for f in self.handled if not os.path.exists(f) ]:
+            del self.handled[filename]
+
+        return sorted(ready)